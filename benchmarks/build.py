@@ -0,0 +1,332 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8; -*-
+
+"""\
+Measure overhead of ino itself on a synthetic project.
+
+A project with the given number of sketches, sources and libraries is
+generated, every source including a number of library headers, along
+with an Arduino distribution having a generated boards.txt and stub
+avr-gcc, avr-g++, avr-ar and avr-objcopy which just create their output
+files. So builds cost nothing but what ino and make do.
+
+Sketch preprocessing and board models are timed in this process.
+Dependency scanning and Makefile rendering are taken from `ino build
+--trace' of full builds. Full builds start without a build directory
+and cache, no-op builds find the firmware up to date and incremental
+ones follow a change of a single source.
+
+Median times are written as JSON with --output, so that results of
+two commits could be compared with --compare, e.g. in CI:
+
+    python2 benchmarks/build.py -o base.json      # on the base commit
+    python2 benchmarks/build.py --compare base.json
+
+The exit status is 1 if any benchmark got slower by more than
+--threshold percent.
+"""
+
+import os
+import os.path
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+from ino.commands.preproc import Preprocess
+from ino.boards import BoardModels, index_boards, load_index
+
+
+# creates the file after -o or the last argument, i.e. output of
+# a compiler, `ar rcs OUT OBJS...' or `objcopy ... IN OUT'
+stub_tool = '''\
+#!/bin/sh
+out=
+case "$(basename "$0")" in
+    avr-ar) out=$2 ;;
+    avr-objcopy) for arg; do out=$arg; done ;;
+    *)
+        while [ $# -gt 0 ]; do
+            if [ "$1" = -o ]; then out=$2; fi
+            shift
+        done
+        ;;
+esac
+[ -n "$out" ] && : > "$out"
+'''
+
+
+def write(path, contents):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def generate_dist(root, boards, core_sources, std_libs):
+    hardware = os.path.join(root, 'hardware', 'arduino')
+    lines = []
+    for i in range(boards):
+        model = 'uno' if i == 0 else 'board%d' % i
+        lines.extend([
+            '%s.name=Generated Board %d' % (model, i),
+            '%s.upload.protocol=arduino' % model,
+            '%s.upload.speed=115200' % model,
+            '%s.build.mcu=atmega328p' % model,
+            '%s.build.f_cpu=16000000L' % model,
+            '%s.build.core=arduino' % model,
+            '%s.build.variant=standard' % model,
+            '',
+        ])
+    write(os.path.join(hardware, 'boards.txt'), '\n'.join(lines))
+    write(os.path.join(root, 'lib', 'version.txt'), '1.0.5\n')
+
+    core = os.path.join(hardware, 'cores', 'arduino')
+    write(os.path.join(core, 'Arduino.h'), '#ifndef Arduino_h\n#define Arduino_h\n'
+          'void setup(void);\nvoid loop(void);\n#endif\n')
+    for i in range(core_sources):
+        write(os.path.join(core, 'core%d.cpp' % i),
+              '#include "Arduino.h"\nint core%d(int x) { return x + %d; }\n' % (i, i))
+    write(os.path.join(hardware, 'variants', 'standard', 'pins_arduino.h'), '#define NUM_PINS 20\n')
+
+    for i in range(std_libs):
+        name = 'Std%d' % i
+        write(os.path.join(root, 'libraries', name, name + '.h'), 'int std%d(int x);\n' % i)
+        write(os.path.join(root, 'libraries', name, name + '.cpp'),
+              '#include "%s.h"\nint std%d(int x) { return x * %d; }\n' % (name, i, i))
+
+    tools = os.path.join(root, 'hardware', 'tools', 'avr', 'bin')
+    for tool in ('avr-gcc', 'avr-g++', 'avr-ar', 'avr-objcopy'):
+        write(os.path.join(tools, tool), stub_tool)
+        os.chmod(os.path.join(tools, tool), 0755)
+    return tools
+
+
+def fan_out(i, libs, fanout):
+    return ['Lib%d' % ((i + j) % libs) for j in range(min(fanout, libs))]
+
+
+def generate_project(root, sketches, sources, libs, fanout, std_libs):
+    for i in range(libs):
+        name = 'Lib%d' % i
+        # a library includes those after it only, so there are no cycles
+        deps = ['Lib%d' % j for j in range(i + 1, min(i + 1 + fanout, libs))]
+        header = ['#pragma once']
+        header.extend('#include "%s.h"' % dep for dep in deps)
+        header.append('int lib%d(int x);' % i)
+        write(os.path.join(root, 'lib', name, name + '.h'), '\n'.join(header) + '\n')
+        write(os.path.join(root, 'lib', name, name + '.cpp'),
+              '#include "%s.h"\nint lib%d(int x) { return x - %d; }\n' % (name, i, i))
+
+    for i in range(sources):
+        lines = ['#include "Arduino.h"']
+        lines.extend('#include <%s.h>' % lib for lib in fan_out(i, libs, fanout))
+        if std_libs:
+            lines.append('#include <Std%d.h>' % (i % std_libs))
+        lines.append('int source%d(int x) { return x ^ %d; }' % (i, i))
+        write(os.path.join(root, 'src', 'source%d.cpp' % i), '\n'.join(lines) + '\n')
+
+    for i in range(sketches):
+        lines = ['#include <%s.h>' % lib for lib in fan_out(i, libs, fanout)]
+        for j in range(20):
+            lines.append('int sketch%d_%d(int x, const char *s) {\n    return x + s[0] + %d;\n}\n' % (i, j, j))
+        if i == 0:
+            lines.append('void setup() {\n}\n\nvoid loop() {\n}\n')
+        write(os.path.join(root, 'src', 'sketch%d.ino' % i), '\n'.join(lines) + '\n')
+
+
+class Runner(object):
+    def __init__(self, tmp_dir, project, dist, tools):
+        self.project = project
+        self.dist = dist
+        self.cache_dir = os.path.join(tmp_dir, 'cache')
+        self.trace_path = os.path.join(tmp_dir, 'trace.json')
+        self.env = dict(os.environ, PYTHONPATH=root_dir, XDG_CACHE_HOME=self.cache_dir,
+                        PATH=tools + os.pathsep + os.environ.get('PATH', ''))
+
+    def ino(self, *args):
+        argv = [sys.executable, os.path.join(root_dir, 'bin', 'ino')] + list(args)
+        with open(os.devnull, 'w') as devnull:
+            start = time.time()
+            subprocess.check_call(argv, cwd=self.project, env=self.env, stdout=devnull)
+            return time.time() - start
+
+    def build(self, *args):
+        return self.ino('build', '-d', self.dist, *args)
+
+    def clean(self):
+        for path in (os.path.join(self.project, '.build'), self.cache_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def phases(self):
+        with open(self.trace_path) as f:
+            events = json.load(f)['traceEvents']
+        phases = {}
+        for event in events:
+            if event.get('cat') == 'phase':
+                phases[event['name']] = phases.get(event['name'], 0) + event['dur'] / 1e6
+        return phases
+
+
+def bench_preproc(project):
+    preprocess = Preprocess(None)
+    sketches = []
+    src_dir = os.path.join(project, 'src')
+    for filename in sorted(os.listdir(src_dir)):
+        if filename.endswith('.ino'):
+            with open(os.path.join(src_dir, filename)) as f:
+                sketches.append(f.read())
+    start = time.time()
+    for sketch in sketches:
+        preprocess.prototypes(sketch)
+    return time.time() - start
+
+
+def bench_board_models(boards_txt, cache_dir):
+    start = time.time()
+    models = BoardModels(load_index([boards_txt], cache_dir))
+    models['uno']
+    return time.time() - start
+
+
+def median(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2]
+
+
+def run_benchmarks(args, tmp_dir):
+    dist = os.path.join(tmp_dir, 'dist')
+    project = os.path.join(tmp_dir, 'project')
+    tools = generate_dist(dist, args.boards, args.core_sources, args.std_libs)
+    generate_project(project, args.sketches, args.sources, args.libs, args.fanout, args.std_libs)
+    runner = Runner(tmp_dir, project, dist, tools)
+    boards_txt = os.path.join(dist, 'hardware', 'arduino', 'boards.txt')
+
+    timings = {}
+
+    def record(name, seconds):
+        timings.setdefault(name, []).append(seconds)
+
+    for _ in range(args.runs):
+        record('preproc', bench_preproc(project))
+
+        board_cache = os.path.join(tmp_dir, 'boards-cache')
+        shutil.rmtree(board_cache, ignore_errors=True)
+        record('board_models (cold)', bench_board_models(boards_txt, board_cache))
+        record('board_models (warm)', bench_board_models(boards_txt, board_cache))
+        start = time.time()
+        index_boards([boards_txt])
+        record('index boards.txt', time.time() - start)
+
+        runner.clean()
+        record('build (full)', runner.build('--trace', runner.trace_path))
+        phases = runner.phases()
+        for phase in ('discover', 'preprocess sketches', 'scan dependencies', 'render makefiles'):
+            record('phase: %s' % phase, phases.get(phase, 0))
+
+        record('build (no-op)', runner.build())
+
+        os.utime(os.path.join(project, 'src', 'source0.cpp'), None)
+        record('build (one source changed)', runner.build())
+
+        record('list-models', runner.ino('list-models', '-d', dist))
+
+    return dict((name, {'median': median(values), 'min': min(values), 'runs': len(values)})
+                for name, values in timings.iteritems())
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=root_dir, stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print results against `baseline` and return names of benchmarks
+    slower by more than `threshold` percent.
+    """
+    regressions = []
+    print '%-36s %10s %10s %8s' % ('benchmark', 'base, ms', 'this, ms', 'change')
+    for name in sorted(results):
+        this = results[name]['median']
+        if name not in baseline:
+            print '%-36s %10s %10.1f' % (name, '-', this * 1000)
+            continue
+        base = baseline[name]['median']
+        change = (this - base) / base * 100 if base else 0.
+        mark = ''
+        if change > threshold:
+            regressions.append(name)
+            mark = '  slower'
+        print '%-36s %10.1f %10.1f %+7.0f%%%s' % (name, base * 1000, this * 1000, change, mark)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help='Number of runs of every benchmark (default: %(default)s)')
+    parser.add_argument('--sketches', type=int, default=4,
+                        help='Number of *.ino sketches (default: %(default)s)')
+    parser.add_argument('--sources', type=int, default=50,
+                        help='Number of *.cpp sources in src (default: %(default)s)')
+    parser.add_argument('--libs', type=int, default=20,
+                        help='Number of libraries in lib (default: %(default)s)')
+    parser.add_argument('--fanout', type=int, default=5,
+                        help='Number of library headers every source and '
+                        'library header includes (default: %(default)s)')
+    parser.add_argument('--boards', type=int, default=100,
+                        help='Number of board models in boards.txt (default: %(default)s)')
+    parser.add_argument('--core-sources', type=int, default=20,
+                        help='Number of Arduino core sources (default: %(default)s)')
+    parser.add_argument('--std-libs', type=int, default=3,
+                        help='Number of standard libraries used (default: %(default)s)')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='Write results to FILE as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare results with ones written by --output before')
+    parser.add_argument('--threshold', type=float, default=20.,
+                        help='Percent of slowdown reported as a regression by '
+                        '--compare (default: %(default)s)')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        results = run_benchmarks(args, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if args.output:
+        params = dict((key, getattr(args, key)) for key in
+                      ('runs', 'sketches', 'sources', 'libs', 'fanout', 'boards',
+                       'core_sources', 'std_libs'))
+        with open(args.output, 'w') as f:
+            json.dump({'revision': git_revision(), 'python': platform.python_version(),
+                       'params': params, 'results': results}, f, indent=2, sort_keys=True)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print
+        print '%d benchmark(s) slower by more than %g%%' % (len(regressions), args.threshold)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8; -*-
+
+"""\
+Measure how fast sketches are preprocessed.
+
+Sketches of the given sizes are generated: mostly large lookup tables,
+string tables and long lines with a number of ordinary functions between
+them, much like generated sketches with fonts or samples.
+
+    python2 benchmarks/preproc.py [-s MB [MB ...]]
+"""
+
+import os.path
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ino.commands.preproc import Preprocess
+
+
+def generate_sketch(size):
+    parts = ['#include <avr/pgmspace.h>\n\n']
+    total = 0
+    i = 0
+    while total < size:
+        table = ', '.join('0x%02x' % (j % 256) for j in range(4096))
+        strings = ',\n'.join('    "line %d: \\"quoted\\" {braces} // not a comment"' % j for j in range(64))
+        chunk = '\n'.join([
+            '// table %d' % i,
+            'const unsigned char table%d[] PROGMEM = {%s};' % (i, table),
+            'const char *strings%d[] = {\n%s\n};' % (i, strings),
+            '/* helper for table %d { } */' % i,
+            'unsigned char lookup%d(int index, char *out) {' % i,
+            '    if (index < 0) { return 0; }',
+            "    out[0] = '{';",
+            '    return pgm_read_byte(&table%d[index]);' % i,
+            '}',
+            '',
+        ])
+        parts.append(chunk)
+        total += len(chunk)
+        i += 1
+    parts.append('void setup() {\n}\n\nvoid loop() {\n}\n')
+    return ''.join(parts), i + 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--sizes', metavar='MB', type=float, nargs='+',
+                        default=[1, 4, 16], help='Sketch sizes in megabytes (default: 1 4 16)')
+    args = parser.parse_args()
+
+    preprocess = Preprocess(None)
+    print '%8s %10s %10s %12s' % ('size, MB', 'functions', 'time, s', 'MB/s')
+    for size in args.sizes:
+        sketch, functions = generate_sketch(int(size * 1024 * 1024))
+        start = time.time()
+        prototypes = preprocess.prototypes(sketch)
+        elapsed = time.time() - start
+        assert len(prototypes) == functions, (len(prototypes), functions)
+        mb = len(sketch) / 1024. / 1024.
+        print '%8.1f %10d %10.2f %12.1f' % (mb, len(prototypes), elapsed, mb / elapsed)
+
+
+if __name__ == '__main__':
+    main()
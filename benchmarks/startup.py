@@ -0,0 +1,93 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8; -*-
+
+"""\
+Measure how long `ino' takes to start and run short commands.
+
+Every command is run in a scratch project with a minimal Arduino
+distribution, first as is and then with all command modules imported
+up front the way ino did before commands were loaded lazily.
+
+    python2 benchmarks/startup.py [-n RUNS]
+"""
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imports every command module before running ino as usual
+eager_main = '; '.join([
+    'import ino.commands',
+    '[ino.commands.load(name) for name, _, _, _ in ino.commands.registry]',
+    'from ino.runner import main',
+    'main()',
+])
+
+
+def setup_project(tmp_dir):
+    dist = os.path.join(tmp_dir, 'dist')
+    os.makedirs(os.path.join(dist, 'hardware', 'arduino'))
+    os.makedirs(os.path.join(dist, 'lib'))
+    with open(os.path.join(dist, 'hardware', 'arduino', 'boards.txt'), 'w') as f:
+        f.write('uno.name=Arduino Uno\nuno.build.mcu=atmega328p\n')
+    with open(os.path.join(dist, 'lib', 'version.txt'), 'w') as f:
+        f.write('1.0.5\n')
+
+    project = os.path.join(tmp_dir, 'project')
+    os.makedirs(os.path.join(project, 'src'))
+    os.makedirs(os.path.join(project, 'lib'))
+    with open(os.path.join(project, 'src', 'sketch.ino'), 'w') as f:
+        f.write('void setup() {\n}\n\nvoid loop() {\n}\n')
+    return project, dist
+
+
+def measure(argv, cwd, runs):
+    env = dict(os.environ, PYTHONPATH=root_dir)
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.check_call(argv, cwd=cwd, env=env, stdout=devnull)
+            timings.append(time.time() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--runs', type=int, default=20,
+                        help='Number of runs of every command (default: %(default)s)')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        project, dist = setup_project(tmp_dir)
+        commands = [
+            ['preproc', '-d', dist, '-o', os.devnull, 'src/sketch.ino'],
+            ['clean'],
+            ['list-models', '-d', dist],
+        ]
+
+        print '%-12s %10s %10s %8s' % ('command', 'lazy, ms', 'eager, ms', 'saving')
+        for command in commands:
+            lazy = measure([sys.executable, os.path.join(root_dir, 'bin', 'ino')] + command,
+                           project, args.runs)
+            eager = measure([sys.executable, '-c', eager_main] + command,
+                            project, args.runs)
+            print '%-12s %10.1f %10.1f %7.0f%%' % (command[0], lazy * 1000, eager * 1000,
+                                                   (eager - lazy) / eager * 100)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -80,6 +80,31 @@ class FlexiFormatter(argparse.RawTextHelpFormatter):
 
         return lines
 
+
+class MultipleAction(argparse.Action):
+    """
+    Action for an option which could be given several times or with a list
+    of values separated by `separator'. The first value is stored as usual,
+    so that commands unaware of this see a single value, and all of them
+    are stored in `<dest>s'.
+    """
+
+    def __init__(self, option_strings, dest, separator=None, **kwargs):
+        super(MultipleAction, self).__init__(option_strings, dest, **kwargs)
+        self.separator = separator
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        values = values.split(self.separator) if self.separator else [values]
+        values = [v for v in values if v]
+        if not values:
+            parser.error('%s expects a value' % option_string)
+
+        all_values = getattr(namespace, self.dest + 's', None) or []
+        all_values.extend(v for v in values if v not in all_values)
+        setattr(namespace, self.dest + 's', all_values)
+        setattr(namespace, self.dest, all_values[0])
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(formatter_class=FlexiFormatter)
     parser.add_argument('--example', help='''\
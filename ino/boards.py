@@ -0,0 +1,137 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import cPickle
+import hashlib
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python < 2.7
+    from ordereddict import OrderedDict
+
+from ino.utils import format_available_options, makedirs, write_atomically
+
+
+class BoardModels(object):
+    """
+    Board models described in boards.txt files.
+
+    Only an index of model names, their human-readable descriptions and
+    files they are described in is kept. Full description of a model is
+    parsed from those files when the model is asked for.
+    """
+
+    def __init__(self, index, default=None):
+        self.index = index
+        self.default = default
+        self.parsed = {}
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, key):
+        if key not in self.parsed:
+            if key not in self.index:
+                raise KeyError(key)
+            self.parsed[key] = parse_board(key, self.index[key][1])
+        return self.parsed[key]
+
+    def format(self):
+        map = [(key, name) for key, (name, _) in self.index.iteritems() if name is not None]
+        return format_available_options(map, head_width=12, default=self.default)
+
+
+def index_boards(boards_txts):
+    """
+    Return OrderedDict of model -> (name, boards_txts) where `name` is
+    value of `model.name' or None and `boards_txts` is list of files
+    the model is mentioned in.
+    """
+    index = OrderedDict()
+    for boards_txt in boards_txts:
+        with open(boards_txt) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                multikey, _, val = line.partition('=')
+                model, _, rest = multikey.partition('.')
+                name, files = index.setdefault(model, (None, []))
+                if boards_txt not in files:
+                    files.append(boards_txt)
+                if rest == 'name':
+                    index[model] = (val, files)
+    return index
+
+
+def load_index(boards_txts, cache_dir):
+    """
+    Return index of `boards_txts` as `index_boards` does. The index is
+    kept in `cache_dir` and built again only if any of the files changes.
+    """
+    key = hashlib.md5('\0'.join(boards_txts)).hexdigest()
+    filepath = os.path.join(cache_dir, 'boards', key + '.pickle')
+    stamp = dict((path, os.path.getmtime(path)) for path in boards_txts)
+
+    try:
+        with open(filepath, 'rb') as f:
+            saved_stamp, index = cPickle.load(f)
+        if saved_stamp == stamp:
+            return index
+    except Exception:
+        pass
+
+    index = index_boards(boards_txts)
+    makedirs(os.path.dirname(filepath))
+    write_atomically(filepath, cPickle.dumps((stamp, index), cPickle.HIGHEST_PROTOCOL))
+    return index
+
+
+def parse_board(model, boards_txts):
+    """
+    Parse description of `model` from `boards_txts` into a nested dict.
+    """
+    board = {}
+    prefix = model + '.'
+    for boards_txt in boards_txts:
+        with open(boards_txt) as f:
+            for line in f:
+                line = line.strip()
+                if not line.startswith(prefix):
+                    continue
+
+                # Transform lines like:
+                #   yun.upload.maximum_data_size=2560
+                # into a nested dict `board` so that
+                #   board['upload']['maximum_data_size'] == 2560
+                multikey, _, val = line.partition('=')
+                multikey = multikey.split('.')[1:]
+
+                # traverse into dictionary up to deepest level
+                # create nested dictionaries if they aren't exist yet
+                subdict = board
+                for key in multikey[:-1]:
+                    if key not in subdict:
+                        subdict[key] = {}
+                    elif not isinstance(subdict[key], dict):
+                        # it happens that a particular key
+                        # has a value and has sublevels at same time. E.g.:
+                        #   diecimila.menu.cpu.atmega168=ATmega168
+                        #   diecimila.menu.cpu.atmega168.upload.maximum_size=14336
+                        #   diecimila.menu.cpu.atmega168.upload.maximum_data_size=1024
+                        #   diecimila.menu.cpu.atmega168.upload.speed=19200
+                        # place value `ATmega168` into a special key `_` in such case
+                        subdict[key] = {'_': subdict[key]}
+                    subdict = subdict[key]
+
+                subdict[multikey[-1]] = val
+
+    # store special `_coredir` value so we later can build paths
+    # relative to a core directory of the board model
+    board['_coredir'] = os.path.dirname(boards_txts[-1])
+    return board
@@ -1,9 +1,36 @@
 # -*- coding: utf-8; -*-
 
-from ino.commands.init import Init
-from ino.commands.preproc import Preprocess
-from ino.commands.build import Build
-from ino.commands.clean import Clean
-from ino.commands.upload import Upload
-from ino.commands.serial import Serial
-from ino.commands.listmodels import ListModels
+"""
+Registry of ino commands.
+
+A command module is imported only when the command is actually run, so
+that e.g. `ino clean' doesn't pay for importing jinja2 or pyserial
+needed by other commands. Names and help lines listed here should match
+attributes of the command classes.
+"""
+
+import importlib
+
+
+# (name, module, class, help line) in the order shown by `ino --help'
+registry = [
+    ('build', 'build', 'Build', "Build firmware from the current directory project"),
+    ('cache', 'cache', 'Cache', "Manage the shared cache of compiled objects"),
+    ('clean', 'clean', 'Clean', "Remove intermediate compilation files completely"),
+    ('daemon', 'daemon', 'Daemon', "Run a background server answering commands faster"),
+    ('init', 'init', 'Init', "Setup a new project in the current directory"),
+    ('list-models', 'listmodels', 'ListModels', "List supported Arduino board models"),
+    ('preproc', 'preproc', 'Preprocess', "Transform a sketch file into valid C++ source"),
+    ('serial', 'serial', 'Serial', "Open a serial monitor"),
+    ('upload', 'upload', 'Upload', "Upload built firmware to the device"),
+]
+
+
+def load(name):
+    """
+    Import module of the command `name` and return the command class.
+    """
+    for cmd_name, module, cls, _ in registry:
+        if cmd_name == name:
+            return getattr(importlib.import_module('ino.commands.' + module), cls)
+    raise KeyError(name)
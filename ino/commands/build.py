@@ -2,20 +2,39 @@
 
 import re
 import os.path
+import sys
+import time
+import fcntl
+import json
+import argparse
+import collections
+import hashlib
 import inspect
+import pickle
 import subprocess
 import platform
+import multiprocessing
+import threading
 import jinja2
 import shlex
 
 from jinja2.runtime import StrictUndefined
 
 import ino.filters
+import ino.inotify
+import ino.unity
 
 from ino.commands.base import Command
-from ino.environment import Version
+from ino.commands.preproc import Preprocess, preprocess_file
+from ino.environment import Environment, Version
 from ino.filters import colorize
-from ino.utils import SpaceList, list_subdirs
+from ino.scanner import IncludeScanner
+from ino.libgraph import LibraryGraph
+from ino.jobserver import JobServer
+from ino.manifest import BuildManifest
+from ino.trace import Tracer
+from ino.utils import SpaceList, DirSnapshot, list_subdirs, cpu_count, makedirs, write_if_changed, \
+    working_dir
 from ino.exc import Abort
 
 
@@ -51,10 +70,35 @@ class Build(Command):
     default_cxxflags = '-fno-exceptions'
     default_ldflags = '-Os --gc-sections'
 
+    default_jobs = cpu_count()
+
+    # bump when layout of the prebuilt store changes
+    prebuilt_version = 1
+
+    # options which don't affect the firmware produced; the whole
+    # matrix is not the business of a single build
+    volatile_args = ('func', 'verbose', 'jobs', 'board_models', 'arduino_dists',
+                     'workspace', 'summary', 'watch', 'trace')
+
+    # seconds of quiet after a change before --watch builds again
+    watch_debounce = 0.1
+
+    def __init__(self, environment, shared=None):
+        super(Build, self).__init__(environment)
+        # board-independent work shared by all builds of a matrix
+        self.shared = {} if shared is None else shared
+        # file to redirect make output to or None
+        self.output = None
+        # project directory if it's not the current one
+        self.cwd = None
+        # timing of build phases and make jobs for --trace
+        self.tracer = self.shared.get('tracer') or Tracer()
+        self.trace_pid = 1
+
     def setup_arg_parser(self, parser):
         super(Build, self).setup_arg_parser(parser)
-        self.e.add_board_model_arg(parser)
-        self.e.add_arduino_dist_arg(parser)
+        self.e.add_board_model_arg(parser, multiple=True)
+        self.e.add_arduino_dist_arg(parser, multiple=True)
 
         parser.add_argument('--make', metavar='MAKE',
                             default=self.default_make,
@@ -114,6 +158,65 @@ class Build(Command):
                             'being invoked directly (i.e. the `-Wl,\' prefix '
                             'should be omitted). Default: "%(default)s".')
 
+        parser.add_argument('-j', '--jobs', metavar='N', type=int,
+                            default=self.default_jobs,
+                            help='Number of compile jobs to run simultaneously. '
+                            'Output of every job is kept together. The build '
+                            'stops as soon as any job fails. Default: number '
+                            'of CPUs (%(default)s).')
+
+        parser.add_argument('--cache', default=False, action='store_true',
+                            help='Look up objects in the cache shared by all '
+                            'projects before calling the compiler. See '
+                            '`ino cache --help\' for details.')
+
+        parser.add_argument('--no-prebuilt', default=False, action='store_true',
+                            help='Build Arduino core and standard libraries in '
+                            'the project build directory instead of linking '
+                            'them from the store shared by all projects.')
+
+        parser.add_argument('--no-pch', default=False, action='store_true',
+                            help='Don\'t precompile the Arduino core header '
+                            'for C++ sources which include it first.')
+
+        parser.add_argument('--compiler-scan', default=False, action='store_true',
+                            help='Find out used libraries by running the '
+                            'compiler in -MM mode rather than with the '
+                            'built-in #include scanner. It is slower but '
+                            'takes conditional compilation into account.')
+
+        parser.add_argument('--unity', default=False, action='store_true',
+                            help='Compile C and C++ sources of the project and '
+                            'of every library built with it in batches, one '
+                            'translation unit per directory and language. '
+                            'Sources which could clash with others, e.g. '
+                            'defining static functions of the same name, are '
+                            'still compiled separately.')
+
+        parser.add_argument('--workspace', metavar='DIR',
+                            help='Build every project found in DIR, i.e. every '
+                            'directory with a `src\' subdirectory, from a '
+                            'single process. Options given apply to all of '
+                            'them. Arduino distribution is discovered once, '
+                            'compile jobs of all projects are scheduled '
+                            'together.')
+
+        parser.add_argument('--summary', metavar='FILE',
+                            help='When building several projects, boards or '
+                            'distributions write results of every build to '
+                            'FILE as JSON.')
+
+        parser.add_argument('--watch', default=False, action='store_true',
+                            help='Keep running and build again as soon as '
+                            'sources of the project or of libraries it uses '
+                            'change. Linux only.')
+
+        parser.add_argument('--trace', metavar='FILE',
+                            help='Write wall time of every build phase and of '
+                            'every compile, archive and link job to FILE in '
+                            'the Chrome trace event format. Open it in '
+                            'chrome://tracing or ui.perfetto.dev.')
+
         parser.add_argument('-v', '--verbose', default=False, action='store_true',
                             help='Verbose make output')
 
@@ -148,6 +251,12 @@ class Build(Command):
 
     def setup_flags(self, args):
         board = self.e.board_model(args.board_model)
+
+        # prefix of every compiler call, i.e. a ccache-like launcher
+        self.e['compiler_launcher'] = SpaceList([self.e.ino, 'cache', '--'] if args.cache else [])
+        # prefix of every recipe command timing the job
+        self.e['trace_launcher'] = SpaceList(self.tracer.launcher(self.trace_pid))
+
         mcu = '-mmcu=' + board['build']['mcu']
         # Hard-code the flags that are essential to building the sketch
         self.e['cppflags'] = SpaceList([
@@ -185,10 +294,76 @@ class Build(Command):
             'deps': '%s.d',
         }
 
+    def setup_prebuilt(self, args):
+        """
+        Arduino core and standard libraries are the same for every project
+        built for a given distribution, board and flags. Choose a directory
+        in the shared store where they are built once and linked from.
+        """
+        self.e['prebuilt_dirs'] = [self.e.arduino_core_dir] + list_subdirs(self.e.arduino_libraries_dir)
+        if args.no_prebuilt:
+            self.e['prebuilt_dir'] = None
+            return
+
+        # standard libraries never include project ones, so compile them
+        # with include flags which don't depend on a particular project
+        self.e['prebuilt_inc_flags'] = self.recursive_inc_lib_flags(self.e.prebuilt_dirs)
+
+        key_parts = [self.e['arduino_dist_dir'] if 'arduino_dist_dir' in self.e else '',
+                     self.e.arduino_lib_version, self.e.cppflags, self.e.prebuilt_inc_flags,
+                     self.e.cflags, self.e.cxxflags]
+        for tool in (self.e.cc, self.e.cxx, self.e.ar):
+            key_parts.extend([tool, os.path.getmtime(tool)])
+
+        key = hashlib.md5('\0'.join(map(str, key_parts))).hexdigest()
+        self.e['prebuilt_dir'] = os.path.join(self.e.cache_dir, 'prebuilt',
+                                              'v%d' % self.prebuilt_version, key)
+
+    def render_makefiles(self):
+        """
+        Render Makefiles for prebuilt libraries and the firmware. They are
+        rendered in advance, since make could be run from another thread
+        while the current directory is another project's one.
+        """
+        self.prebuilt_makefile = None
+        if self.e.prebuilt_libs:
+            self.prebuilt_makefile = self.render_template('Makefile.prebuilt.jinja', 'Makefile.prebuilt')
+        self.makefile = self.render_template('Makefile.jinja', 'Makefile')
+
+    def make_prebuilt(self):
+        if self.prebuilt_makefile is None:
+            return
+
+        # built by this very process already, e.g. by the previous
+        # build of --watch or for another project of a workspace
+        key = ('prebuilt', self.e.prebuilt_dir, tuple(self.e.prebuilt_libs))
+        if key in self.shared:
+            return
+
+        makedirs(self.e.prebuilt_dir)
+        with open(os.path.join(self.e.prebuilt_dir, '.lock'), 'w') as lock:
+            # another ino process could build the same libraries right now
+            with self.phase('wait for prebuilt lock'):
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            with self.phase('make prebuilt'):
+                self.run_make(self.prebuilt_makefile)
+        self.shared[key] = True
+
+    def make_firmware(self):
+        self.make_prebuilt()
+        with self.phase('make firmware'):
+            self.run_make(self.makefile)
+
     def create_jinja(self, verbose):
         templates_dir = os.path.join(os.path.dirname(__file__), '..', 'make')
+
+        # keep compiled templates between runs
+        bytecode_dir = os.path.join(self.e.cache_dir, 'jinja')
+        makedirs(bytecode_dir)
+
         self.jenv = jinja2.Environment(
             loader=jinja2.FileSystemLoader(templates_dir),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_dir),
             undefined=StrictUndefined, # bark on Undefined render
             extensions=['jinja2.ext.do'])
 
@@ -196,7 +371,8 @@ class Build(Command):
         for name, f in inspect.getmembers(ino.filters, lambda x: getattr(x, 'filter', False)):
             self.jenv.filters[name] = f
 
-        # inject globals
+        # inject globals; `e' is replaced with a fresh snapshot on every
+        # render since the environment changes between them
         self.jenv.globals['e'] = self.e
         self.jenv.globals['v'] = '' if verbose else '@'
         self.jenv.globals['slash'] = os.path.sep
@@ -204,19 +380,125 @@ class Build(Command):
 
     def render_template(self, source, target, **ctx):
         template = self.jenv.get_template(source)
-        contents = template.render(**ctx)
+        contents = template.render(e=self.e.freeze(), **ctx)
         out_path = os.path.join(self.e.build_dir, target)
         with open(out_path, 'wt') as f:
             f.write(contents)
 
         return out_path
 
+    def make_version(self):
+        if 'make_version' not in self.e:
+            proc = subprocess.Popen([self.e.make, '--version'],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, _ = proc.communicate()
+            match = re.search(r'GNU Make (\d+)\.(\d+)', out)
+            self.e['make_version'] = tuple(map(int, match.groups())) if match else None
+            self.e.stamp('make_version', [self.e.make])
+        return self.e['make_version']
+
+    def setup_make_flags(self, jobs, jobserver=None):
+        if jobs < 1:
+            raise Abort("Number of jobs should be positive, got %s" % jobs)
+
+        # make itself schedules the dependency graph described by generated
+        # Makefiles; without `-k' it starts no new jobs after a failure
+        self.make_flags = ['-j%d' % jobs]
+        self.make_env = None
+
+        # a jobserver decides how many jobs to run, make refuses to use
+        # it if the number is given explicitly
+        version = self.make_version()
+        if jobserver is not None:
+            self.make_flags = []
+            self.make_env = dict(os.environ, MAKEFLAGS=jobserver.makeflags(version))
+
+        # GNU Make 4.0+ can buffer output of each target and print it
+        # at once so that messages of parallel compilers don't interleave
+        if jobs > 1 and version and version >= (4, 0):
+            self.make_flags.append('--output-sync=target')
+
     def make(self, makefile, **kwargs):
-        makefile = self.render_template(makefile + '.jinja', makefile, **kwargs)
-        ret = subprocess.call([self.e.make, '-f', makefile, 'all'])
+        self.run_make(self.render_template(makefile + '.jinja', makefile, **kwargs))
+
+    def run_make(self, makefile):
+        ret = subprocess.call([self.e.make, '-f', makefile] + self.make_flags + ['all'],
+                              stdout=self.output, stderr=self.output,
+                              cwd=self.cwd, env=self.make_env)
         if ret != 0:
             raise Abort("Make failed with code %s" % ret)
 
+    def preprocess_sketches(self, jobs):
+        """
+        Transform all *.ino and *.pde sketches changed since the previous
+        build. This is done in this very process (or a pool of its forks)
+        rather than by spawning `ino preproc' for every sketch.
+
+        Generated *.cpp files are rewritten only if their contents change,
+        so a sketch which is touched or saved unchanged isn't recompiled.
+        """
+        src_build_dir = os.path.join(self.e.build_dir, os.path.basename(self.e.src_dir))
+        sketches = ino.filters.glob(self.e.src_dir, '*.pde', '*.ino')
+        sketches = ino.filters.filemap(sketches, src_build_dir, self.e.names['cpp'])
+
+        # source -> (mtime, digest) as of the previous preprocessing
+        record_filepath = os.path.join(self.e.build_dir, 'sketches.pickle')
+        try:
+            with open(record_filepath, 'rb') as f:
+                record = pickle.load(f)
+        except Exception:
+            record = {}
+
+        stale = []
+        for source, target in sketches.iterpaths():
+            mtime = os.path.getmtime(source)
+            if os.path.exists(target) and record.get(source, (None, None))[0] == mtime:
+                continue
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            stale.append((source, target, mtime))
+            if DirSnapshot.current is not None:
+                DirSnapshot.current.invalidate(os.path.dirname(target))
+
+        if not stale:
+            return
+
+        # sketches already transformed by another build of a matrix
+        # with the same header are copied from its build directory
+        header = Preprocess(self.e).header()
+        done = self.shared.setdefault('sketches', {})
+        copied = [(source, target, mtime) for source, target, mtime in stale
+                  if (os.path.abspath(source), header, mtime) in done]
+        stale = [task for task in stale if task not in copied]
+        for source, target, mtime in copied:
+            digest, done_target = done[(os.path.abspath(source), header, mtime)]
+            with open(done_target, 'rb') as f:
+                written = write_if_changed(target, f.read())
+            record[source] = (mtime, digest)
+            if written:
+                print colorize(source, 'yellow')
+
+        tasks = [(source, target, header, record.get(source, (None, None))[1])
+                 for source, target, _ in stale]
+
+        if jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(tasks)))
+            try:
+                results = pool.map(preprocess_file, tasks)
+            finally:
+                pool.terminate()
+        else:
+            results = map(preprocess_file, tasks)
+
+        for (source, target, mtime), (digest, written) in zip(stale, results):
+            record[source] = (mtime, digest)
+            done[(os.path.abspath(source), header, mtime)] = (digest, os.path.abspath(target))
+            if written:
+                print colorize(source, 'yellow')
+
+        with open(record_filepath, 'wb') as f:
+            pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+
     def recursive_inc_lib_flags(self, libdirs):
         flags = SpaceList()
         for d in libdirs:
@@ -227,7 +509,6 @@ class Build(Command):
     def _scan_dependencies(self, dir, lib_dirs, inc_flags):
         output_filepath = os.path.join(self.e.build_dir, os.path.basename(dir), 'dependencies.d')
         self.make('Makefile.deps', inc_flags=inc_flags, src_dir=dir, output_filepath=output_filepath)
-        self.e['deps'].append(output_filepath)
 
         # search for dependencies on libraries
         # for this scan dependency file generated by make
@@ -243,46 +524,570 @@ class Build(Command):
 
         return used_libs
 
-    def scan_dependencies(self):
-        self.e['deps'] = SpaceList()
-
-        lib_dirs = [self.e.arduino_core_dir] + list_subdirs(self.e.lib_dir) + list_subdirs(self.e.arduino_libraries_dir)
-        inc_flags = self.recursive_inc_lib_flags(lib_dirs)
-
-        # If lib A depends on lib B it have to appear before B in final
-        # list so that linker could link all together correctly
-        # but order of `_scan_dependencies` is not defined, so...
-        
-        # 1. Get dependencies of sources in arbitrary order
-        used_libs = list(self._scan_dependencies(self.e.src_dir, lib_dirs, inc_flags))
-
-        # 2. Get dependencies of dependency libs themselves: existing dependencies
-        # are moved to the end of list maintaining order, new dependencies are appended
-        scanned_libs = set()
-        while scanned_libs != set(used_libs):
-            for lib in set(used_libs) - scanned_libs:
-                dep_libs = self._scan_dependencies(lib, lib_dirs, inc_flags)
-
-                i = 0
-                for ulib in used_libs[:]:
-                    if ulib in dep_libs:
-                        # dependency lib used already, move it to the tail
-                        used_libs.append(used_libs.pop(i))
-                        dep_libs.remove(ulib)
-                    else:
-                        i += 1
-
-                # append new dependencies to the tail
-                used_libs.extend(dep_libs)
-                scanned_libs.add(lib)
+    def dir_sources(self, dir):
+        """
+        Return list of (path, quote_dir) pairs for sources to be scanned
+        in `dir` as IncludeScanner expects them.
+        """
+        sources = [(s.path, None) for s in ino.filters.glob(dir, '*.c', '*.cpp')]
+        if dir == self.e.src_dir:
+            # generated sketch sources should find headers near original sketches
+            src_build_dir = os.path.join(self.e.build_dir, os.path.basename(self.e.src_dir))
+            for s in ino.filters.glob(src_build_dir, '*.cpp'):
+                sources.append((s.path, os.path.join(self.e.src_dir, os.path.dirname(s.filename))))
+        return sources
+
+    def _scan_includes(self, dir):
+        """
+        Find out libraries used by `dir` with the built-in scanner. Return
+        dependencies and stamp of all files examined as LibraryGraph wants.
+        """
+        # library directories are listed only if anything is to be scanned
+        if self.scanner is None:
+            self.scanner = self.include_scanner()
+
+        sources = self.dir_sources(dir)
+        headers = self.scanner.headers(sources)
+        deps = self.scanner.libs(headers, exclude=dir)
+
+        # directories are stamped too to notice added and removed sources;
+        # generated sketch sources share directories with objects, so they
+        # are noticed through their sketches instead
+        dirs = [dir] + list_subdirs(dir, recursive=True)
+        stamp = LibraryGraph.stamp(dirs + [path for path, _ in sources] + list(headers))
+
+        # remember include directories every source actually needs
+        include_dirs = dict((path, self.scanner.include_dirs(path, quote_dir))
+                            for path, quote_dir in sources)
+        return deps, stamp, include_dirs
+
+    def include_scanner(self):
+        """
+        Return IncludeScanner for library directories of the build. Builds
+        of a matrix share a scanner if their directories are the same, and
+        directives read from files in any case.
+        """
+        # project libraries are given relative to the project directory
+        key = ('scanner', os.getcwd(), tuple(self.lib_dirs))
+        if key not in self.shared:
+            scanner = IncludeScanner(self.lib_dirs, os.path.join(self.e.build_dir, 'includes.pickle'))
+            scanner.cache = self.shared.setdefault('directives', scanner.cache)
+            self.shared[key] = scanner
+        return self.shared[key]
 
+    def _scan_with_compiler(self, dir):
+        if self.inc_flags is None:
+            self.inc_flags = self.recursive_inc_lib_flags(self.lib_dirs)
+        # the compiler doesn't tell what it has examined, so rescan every time
+        return self._scan_dependencies(dir, self.lib_dirs, self.inc_flags), None, None
+
+    def scan_dependencies(self, compiler_scan=False):
+        self.lib_dirs = [self.e.arduino_core_dir] + list_subdirs(self.e.lib_dir) + list_subdirs(self.e.arduino_libraries_dir)
+        self.scanner = None
+        self.inc_flags = None
+
+        # a graph kept in memory, e.g. by --watch, is as good as the saved one
+        graph_filepath = os.path.join(self.e.build_dir, 'libgraph.pickle')
+        graph_key = ('graph', os.path.abspath(graph_filepath))
+        scan_mode = 'compiler' if compiler_scan else 'builtin'
+        graph = self.shared.get(graph_key)
+        if graph is None or graph.lib_dirs != self.lib_dirs or graph.scan_mode != scan_mode:
+            graph = LibraryGraph.load(graph_filepath, self.lib_dirs, scan_mode)
+        self.shared[graph_key] = graph
+        graph.resolve(self.e.src_dir, self._scan_with_compiler if compiler_scan else self._scan_includes)
+
+        # if lib A depends on lib B it has to appear before B in the
+        # final list so that linker could link all together correctly
+        used_libs, cycles = graph.link_order(self.e.src_dir)
+        for cycle in cycles:
+            print colorize('Circular dependency between libraries: %s' %
+                           ', '.join(map(os.path.basename, cycle)), 'yellow')
+
+        graph.save(graph_filepath)
+        self.graph = graph
+        if self.scanner:
+            self.scanner.save()
+
+        # archives with mutual dependencies have to be linked as a group
+        self.e['lib_cycles'] = bool(cycles)
         self.e['used_libs'] = used_libs
-        self.e['cppflags'].extend(self.recursive_inc_lib_flags(used_libs))
+
+        # split libraries keeping the link order; standard libraries
+        # never depend on project ones so they could go last
+        prebuilt = self.e.prebuilt_dirs if self.e.prebuilt_dir else []
+        self.e['prebuilt_libs'] = [lib for lib in used_libs if lib in prebuilt]
+        self.e['project_libs'] = [lib for lib in used_libs if lib not in prebuilt]
+
+        # sources whose include directories are not known are compiled
+        # with flags for all used libraries
+        self.e['lib_inc_flags'] = self.recursive_inc_lib_flags(used_libs)
+        self.setup_source_inc_flags(graph)
+
+    def setup_source_inc_flags(self, graph):
+        """
+        Give every source only `-I' flags for directories its headers are
+        found in rather than all the directories of all used libraries.
+        """
+        prebuilt_places = tuple(d + os.path.sep for d in self.e.prebuilt_dirs)
+        self.e['source_inc_flags'] = {}
+        for node in [self.e.src_dir] + self.e.used_libs:
+            for source, include_dirs in (graph.data(node) or {}).iteritems():
+                if include_dirs is None:
+                    continue
+                if node in self.e.prebuilt_libs and not all(
+                        (d + os.path.sep).startswith(prebuilt_places) for d in include_dirs):
+                    # a project library shadows a standard one, keep objects
+                    # in the shared store independent from the project
+                    continue
+                flags = ['-I' + d for d in include_dirs]
+                self.e['source_inc_flags'][source] = SpaceList(f for f in flags if f not in self.e.cppflags)
+
+    def setup_unity(self, enabled):
+        """
+        Batch sources of the project and of libraries built with it into
+        unity sources if `enabled`. Generated sketch sources need their own
+        -iquote flags and are always compiled separately.
+        """
+        self.e['unity_members'] = {}
+        if not enabled:
+            return
+
+        # kept apart from generated sketch sources which are globbed
+        for source_dir in [self.e.src_dir] + self.e.project_libs:
+            target_dir = os.path.join(self.e.build_dir, 'unity', os.path.basename(source_dir))
+            for ext in ('c', 'cpp'):
+                sources = ino.filters.glob(source_dir, '*.' + ext).paths()
+                batch, _ = ino.unity.partition(sources)
+                if len(batch) < 2:
+                    continue
+
+                unity_path = os.path.join(target_dir, 'unity-%s.%s' % (ext, ext))
+                makedirs(target_dir)
+                write_if_changed(unity_path, ino.unity.unity_source(map(os.path.abspath, batch)))
+                for source in batch:
+                    self.e.unity_members[source] = unity_path
+
+                # a unity source needs include directories of all its members
+                if all(source in self.e.source_inc_flags for source in batch):
+                    flags = SpaceList()
+                    for source in batch:
+                        flags.extend(f for f in self.e.source_inc_flags[source] if f not in flags)
+                    self.e.source_inc_flags[unity_path] = flags
+
+    # the core header included first, possibly after comments
+    core_include_regex = re.compile(r'(?:\s+|//[^\n]*|/\*.*?\*/)*#\s*include\s*[<"](\S+?)[>"]', re.DOTALL)
+
+    def includes_first(self, source, header):
+        with open(source) as f:
+            match = self.core_include_regex.match(f.read(4096))
+        return match is not None and match.group(1) == header
+
+    def setup_pch(self, enabled):
+        """
+        Prepare a precompiled core header for project C++ sources which
+        include it before anything else, sketch sources always do. The
+        header is kept in a directory named after the compiler flags so
+        that it is built again whenever they change.
+        """
+        self.e['pch_header'] = None
+        self.e['pch_sources'] = set()
+        if not enabled:
+            return
+
+        header = Preprocess(self.e).header()
+        flags_hash = hashlib.md5(' '.join(map(str, [self.e.cxx, self.e.cppflags, self.e.cxxflags]))).hexdigest()[:8]
+        pch_dir = os.path.join(self.e.build_dir, 'pch', flags_hash)
+        self.e['pch_header'] = os.path.join(pch_dir, header)
+        makedirs(pch_dir)
+        write_if_changed(self.e.pch_header, '#include <%s>\n' % header)
+
+        src_build_dir = os.path.join(self.e.build_dir, os.path.basename(self.e.src_dir))
+        self.e.pch_sources.update(ino.filters.glob(src_build_dir, '*.cpp').paths())
+        for source_dir in [self.e.src_dir] + self.e.project_libs:
+            for source in ino.filters.glob(source_dir, '*.cpp').paths():
+                if source not in self.e.unity_members and self.includes_first(source, header):
+                    self.e.pch_sources.add(source)
+
+    def manifest_key(self, args):
+        options = sorted((k, v) for k, v in vars(args).iteritems() if k not in self.volatile_args)
+        return BuildManifest.key([self.e.build_dir, options])
+
+    def manifest_inputs(self):
+        """
+        Return list of files the build depends on besides sources and
+        headers tracked by the library graph.
+        """
+        inputs = [self.e[tool] for tool in ('make', 'cc', 'cxx', 'ar', 'objcopy')]
+        inputs.extend(self.e['boards.txt'])
+        inputs.append(self.e['version.txt'])
+        inputs.extend(ino.filters.glob(os.path.join(os.path.dirname(__file__), '..', 'make'), '*.jinja').paths())
+        inputs.extend(ino.filters.glob(self.e.src_dir, '*.pde', '*.ino').paths())
+        return inputs
+
+    def manifest_stamp(self, inputs_stamp):
+        """
+        Return stamp of everything the build depends on or None if
+        some dependencies are unknown, e.g. with --compiler-scan.
+        """
+        stamp = dict(inputs_stamp)
+        for node in [self.e.src_dir] + self.e.used_libs:
+            _, node_stamp, _ = self.graph.nodes[node]
+            if node_stamp is None:
+                return None
+            stamp.update(node_stamp)
+        stamp[self.e.hex_path] = os.path.getmtime(self.e.hex_path)
+        return stamp
+
+    def matrix(self, args):
+        """
+        Return list of (project directory, board model, distribution)
+        triples to build for. Project directory is None for the current one.
+        """
+        models = getattr(args, 'board_models', None) or [args.board_model]
+        dists = getattr(args, 'arduino_dists', None) or [args.arduino_dist]
+        workspace = getattr(args, 'workspace', None)
+        projects = [None]
+        if workspace:
+            projects = self.find_projects(workspace)
+            # projects are prepared from their own directories
+            dists = [os.path.abspath(dist) if dist else dist for dist in dists]
+        return [(project, model, dist) for project in projects
+                for dist in dists for model in models]
+
+    def find_projects(self, root):
+        """
+        Return list of directories within `root` having a `src'
+        subdirectory. Projects and hidden directories are not looked into.
+        """
+        projects = []
+        for dirpath, dirnames, _ in os.walk(root):
+            if self.e.src_dir in dirnames:
+                projects.append(os.path.abspath(dirpath))
+                dirnames[:] = []
+            else:
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        if not projects:
+            raise Abort('No projects found in %s' % root)
+        return projects
 
     def run(self, args):
-        self.discover(args)
-        self.setup_flags(args)
-        self.create_jinja(verbose=args.verbose)
-        self.make('Makefile.sketch')
-        self.scan_dependencies()
-        self.make('Makefile')
+        self.tracer = self.shared['tracer'] = Tracer(args.trace)
+        try:
+            targets = self.matrix(args)
+            if args.watch:
+                if len(targets) > 1 or args.workspace:
+                    raise Abort("--watch builds a single project for a single board model")
+                self.run_watch(args)
+            elif len(targets) > 1 or args.workspace:
+                self.run_matrix(args, targets)
+            else:
+                self.run_once(args)
+        finally:
+            self.tracer.save()
+            self.tracer.close()
+
+    def phase(self, name):
+        return self.tracer.phase(name, self.trace_pid)
+
+    def run_once(self, args):
+        manifest = BuildManifest(os.path.join(self.e.build_dir, 'manifest.pickle'))
+        key = self.manifest_key(args)
+        with self.phase('check manifest'):
+            up_to_date = manifest.is_up_to_date(key)
+        if up_to_date:
+            print colorize('Firmware is up to date', 'green')
+            return
+
+        # a failed build should never be considered up to date
+        manifest.discard()
+
+        # source and library trees are listed once for the whole build
+        with DirSnapshot():
+            self.build(args, manifest, key)
+
+    def run_watch(self, args):
+        """
+        Build, then wait for changes in the project and libraries it uses
+        and build again until interrupted.
+
+        Everything is kept in memory between builds: the environment with
+        parsed board models, the library graph, #include directives and
+        whether prebuilt libraries are up to date. So a build after a
+        change costs little more than compiling the changed sources.
+        """
+        if not ino.inotify.available:
+            raise Abort("--watch needs Linux inotify")
+
+        watcher = ino.inotify.TreeWatcher(exclude=['examples'])
+        roots = [self.e.src_dir, self.e.lib_dir]
+        try:
+            while True:
+                try:
+                    self.run_once(args)
+                except Abort as exc:
+                    print colorize(str(exc), 'red')
+                self.e.dump()
+
+                # used libraries are known unless the build failed early
+                if 'used_libs' in self.e:
+                    roots = [self.e.src_dir, self.e.lib_dir] + self.e.used_libs
+                watcher.watch(roots)
+                print colorize('Watching for changes, press Ctrl+C to stop', 'green')
+
+                changed, structure = watcher.wait(self.watch_debounce)
+                if structure:
+                    # header index of scanners doesn't know new or removed files
+                    for key in [k for k in self.shared if k[0] == 'scanner']:
+                        del self.shared[key]
+                self.forget_prebuilt(changed)
+                print colorize('%d file(s) changed' % len(changed), 'green')
+        finally:
+            watcher.close()
+
+    def forget_prebuilt(self, changed):
+        """
+        Make prebuilt libraries be made again if any of `changed` paths
+        is within their sources, so that an edit of a standard library
+        is compiled rather than the old archive linked.
+        """
+        if 'prebuilt_dirs' not in self.e:
+            return
+        places = tuple(os.path.abspath(d) + os.path.sep for d in self.e.prebuilt_dirs)
+        if any((os.path.abspath(path) + os.path.sep).startswith(places) for path in changed):
+            for key in [k for k in self.shared if k[0] == 'prebuilt']:
+                del self.shared[key]
+
+    def build(self, args, manifest, key):
+        inputs_stamp = self.prepare(args)
+        self.make_firmware()
+        self.save_manifest(manifest, key, inputs_stamp)
+
+    def prepare(self, args):
+        """
+        Do everything but running make. Return stamp of files listed by
+        `manifest_inputs'.
+        """
+        with self.phase('discover'):
+            self.discover(args)
+        with self.phase('stamp inputs'):
+            inputs_stamp = LibraryGraph.stamp(self.manifest_inputs())
+
+        with self.phase('setup flags'):
+            self.setup_flags(args)
+            self.setup_prebuilt(args)
+            self.setup_make_flags(args.jobs)
+            self.create_jinja(verbose=args.verbose)
+        with self.phase('preprocess sketches'):
+            self.preprocess_sketches(args.jobs)
+        with self.phase('scan dependencies'):
+            self.scan_dependencies(args.compiler_scan)
+        with self.phase('setup unity'):
+            self.setup_unity(args.unity)
+        with self.phase('setup pch'):
+            self.setup_pch(not args.no_pch)
+        with self.phase('render makefiles'):
+            self.render_makefiles()
+        return inputs_stamp
+
+    def save_manifest(self, manifest, key, inputs_stamp):
+        with self.phase('save manifest'):
+            stamp = self.manifest_stamp(inputs_stamp)
+            if stamp is not None:
+                manifest.save(key, stamp)
+
+    def run_matrix(self, args, targets):
+        """
+        Build firmware for every project, board model and distribution.
+
+        Targets are prepared one after another in this process. Things
+        discovered in a distribution are reused by all of them and so are
+        transformed sketches and #include directives. Then makes for all
+        targets are run as described in `make_matrix'.
+        """
+        if args.jobs < 1:
+            raise Abort("Number of jobs should be positive, got %s" % args.jobs)
+
+        several_models = len(set(model for _, model, _ in targets)) > 1
+        several_dists = len(set(dist for _, _, dist in targets)) > 1
+        shared = {'tracer': self.tracer}
+        # environment with everything discovered in a distribution
+        bases = {}
+        matrix = []
+        for project, model, dist in targets:
+            label = []
+            if project:
+                label.append(os.path.relpath(project, args.workspace))
+            if several_models or not project:
+                label.append(model)
+            if several_dists:
+                label.append(dist or 'default')
+            if len(label) > 1:
+                label = '%s (%s)' % (label[0], ', '.join(label[1:]))
+            else:
+                label = label[0]
+
+            target_args = argparse.Namespace(**vars(args))
+            target_args.board_model = model
+            target_args.arduino_dist = dist
+            if dist not in bases:
+                bases[dist] = Environment()
+                bases[dist].load()
+
+            target = MatrixTarget(project, label)
+            matrix.append(target)
+            print colorize('Preparing %s' % target.label, 'green')
+            target.prepare(target_args, bases[dist], shared)
+
+        self.make_matrix([target for target in matrix if target.build], args.jobs)
+
+        print
+        print self.format_matrix(matrix)
+        if args.summary:
+            with open(args.summary, 'w') as f:
+                json.dump([target.summary() for target in matrix], f, indent=2, sort_keys=True)
+
+        failed = [target for target in matrix if target.status == 'FAILED']
+        if failed:
+            raise Abort('%d of %d builds failed' % (len(failed), len(matrix)))
+
+    def make_matrix(self, matrix, jobs):
+        """
+        Run makes for all targets prepared, at most `jobs` of them at
+        once. With GNU Make they all are clients of a single jobserver,
+        so that no more than `jobs` compile jobs run at once in total and
+        jobs are given to whichever make has something to do. Output of
+        every make is kept in `build.log' of its build directory and
+        printed as soon as the make finishes.
+        """
+        if not matrix:
+            return
+
+        workers = min(len(matrix), jobs)
+        jobserver = None
+        if all(target.build.make_version() for target in matrix):
+            jobserver = JobServer(jobs, workers)
+        for target in matrix:
+            target.build.setup_make_flags(jobs if jobserver else max(jobs // workers, 1), jobserver)
+
+        queue = collections.deque(matrix)
+
+        def work():
+            while True:
+                try:
+                    target = queue.popleft()
+                except IndexError:
+                    break
+                target.make()
+            # no more makes to start, give the job slot to running ones
+            if jobserver:
+                jobserver.release()
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if jobserver:
+            jobserver.close()
+
+        # the manifest refers to files relative to the project directory
+        for target in matrix:
+            if target.status == 'ok':
+                with working_dir(target.project):
+                    target.build.save_manifest(target.manifest, target.key, target.inputs_stamp)
+
+    def format_matrix(self, matrix):
+        width = max(len(target.label) for target in matrix)
+        colors = {'ok': 'green', 'up to date': 'green', 'FAILED': 'red'}
+        lines = []
+        for target in matrix:
+            status = colorize('%-10s' % target.status, colors[target.status])
+            line = '%-*s  %s %6.1fs' % (width, target.label, status, target.seconds)
+            if target.message:
+                line += '  ' + target.message
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class MatrixTarget(object):
+    """
+    Build for a single project, board model and distribution of a matrix.
+    """
+
+    # make output of targets finishing at the same time shouldn't mix
+    output_lock = threading.Lock()
+
+    def __init__(self, project, label):
+        self.project = project
+        self.label = label
+        self.build = None
+        self.status = None
+        self.message = None
+        self.seconds = 0.0
+        self.args = None
+        self.hex_path = None
+
+    def prepare(self, args, base, shared):
+        """
+        Prepare the build with environment forked from `base` and give
+        everything discovered back to it.
+        """
+        start = time.time()
+        self.args = args
+        with working_dir(self.project):
+            e = base.fork()
+            try:
+                e.process_args(args)
+                e.create_project_dirs()
+                self.hex_path = os.path.abspath(e.hex_path)
+                self.manifest = BuildManifest(os.path.join(e.build_dir, 'manifest.pickle'))
+                build = Build(e, shared)
+                build.trace_pid = build.tracer.process(self.label)
+                self.key = build.manifest_key(args)
+                if self.manifest.is_up_to_date(self.key):
+                    self.status = 'up to date'
+                    return
+                self.manifest.discard()
+                # listings are relative to the project directory
+                with shared.setdefault(('snapshot', os.getcwd()), DirSnapshot()):
+                    self.inputs_stamp = build.prepare(args)
+                build.cwd = self.project
+                self.log_filepath = os.path.abspath(os.path.join(e.build_dir, 'build.log'))
+                self.build = build
+            except Abort as exc:
+                self.status = 'FAILED'
+                self.message = str(exc)
+            finally:
+                base.adopt(e)
+                e.dump()
+                self.seconds += time.time() - start
+
+    def make(self):
+        start = time.time()
+        # anything but a clean finish is a failure
+        self.status = 'FAILED'
+        with open(self.log_filepath, 'w') as log:
+            self.build.output = log
+            try:
+                self.build.make_firmware()
+                self.status = 'ok'
+            except Abort as exc:
+                self.message = str(exc)
+        self.seconds += time.time() - start
+
+        with self.output_lock:
+            print colorize('Output for %s:' % self.label, 'green' if self.status == 'ok' else 'red')
+            with open(self.log_filepath) as log:
+                sys.stdout.write(log.read())
+            sys.stdout.flush()
+
+    def summary(self):
+        return {
+            'project': self.project or os.getcwd(),
+            'board_model': self.args.board_model,
+            'arduino_dist': self.args.arduino_dist,
+            'status': self.status,
+            'message': self.message,
+            'seconds': round(self.seconds, 2),
+            'firmware': self.hex_path if self.status in ('ok', 'up to date') else None,
+        }
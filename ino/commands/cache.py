@@ -0,0 +1,60 @@
+# -*- coding: utf-8; -*-
+
+import sys
+import os.path
+
+from ino.commands.base import Command
+from ino.filters import colorize
+from ino.objcache import ObjectCache, parse_size, format_size
+
+
+class Cache(Command):
+    """
+    Manage the object cache shared by all projects.
+
+    When a project is built with `ino build --cache' every compiler call
+    goes through `ino cache -- COMPILER ARGS'. The source file is
+    preprocessed and the compiled object is looked up by a hash of the
+    preprocessed text, the compiler identity and all the flags. On a hit
+    the object is copied from the cache and the compiler is not run at all.
+
+    Without a compiler command line, statistics are printed.
+    """
+
+    name = 'cache'
+    help_line = "Manage the shared cache of compiled objects"
+
+    default_max_size = '1G'
+
+    def setup_arg_parser(self, parser):
+        super(Cache, self).setup_arg_parser(parser)
+        parser.add_argument('-C', '--clear', default=False, action='store_true',
+                            help='Remove all cached objects')
+        parser.add_argument('-M', '--max-size', metavar='SIZE',
+                            default=self.default_max_size,
+                            help='Maximal total size of cached objects, e.g. '
+                            '500M or 5G. Least recently used objects are '
+                            'evicted when it is exceeded. Default: "%(default)s".')
+        parser.add_argument('compiler', nargs='*', metavar='ARGS',
+                            help='Compiler command line to run through the cache')
+
+        parser.usage = "%(prog)s [-h] [-C] [-M SIZE] [-- ARGS]"
+
+    def run(self, args):
+        cache = ObjectCache(os.path.join(self.e.cache_dir, 'objects'),
+                            parse_size(args.max_size))
+
+        if args.compiler:
+            sys.exit(cache.compile(args.compiler))
+
+        if args.clear:
+            cache.clear()
+
+        with cache.stats() as stats:
+            requests = stats['hits'] + stats['misses']
+            rate = 100. * stats['hits'] / requests if requests else 0.
+            print 'Cache directory:', colorize(cache.root, 'cyan')
+            print 'Cache hits:     ', stats['hits'], colorize('(%.1f%%)' % rate, 'green')
+            print 'Cache misses:   ', stats['misses']
+            print 'Evicted objects:', stats['evicted']
+            print 'Cache size:     ', format_size(stats['size']), '/', format_size(cache.max_size)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8; -*-
+
+import os
+import sys
+
+from ino.commands.base import Command
+from ino.daemon import Server, connect, request, socket_path, commands
+from ino.environment import Environment
+from ino.exc import Abort
+
+
+class Daemon(Command):
+    """
+    Run a background server which keeps ino warm to answer commands faster.
+
+    Once the server is started, `ino %s' commands are
+    sent to it over a Unix socket instead of being run by a new process,
+    which saves importing all the modules and parsing configuration files
+    every time. Every command is still run in a separate process forked by
+    the server, so it behaves just as if it was run directly.
+
+    The server stops by itself after a period without commands.
+    """ % "', `ino ".join(commands)
+
+    name = 'daemon'
+    help_line = "Run a background server answering commands faster"
+
+    default_idle_timeout = 600
+
+    def setup_arg_parser(self, parser):
+        super(Daemon, self).setup_arg_parser(parser)
+        parser.add_argument('action', choices=['start', 'stop', 'status'],
+                            help='Start or stop the server or check whether it is running')
+        parser.add_argument('--idle-timeout', metavar='SECONDS', type=int,
+                            default=self.default_idle_timeout,
+                            help='Stop the server after that many seconds without '
+                            'commands. Default: %(default)s.')
+        parser.add_argument('-f', '--foreground', default=False, action='store_true',
+                            help='Keep the server attached to the terminal')
+
+    def run(self, args):
+        sock = connect()
+        if args.action == 'start':
+            if sock is not None:
+                raise Abort('ino daemon is already running')
+            self.start(args)
+            return
+
+        if sock is None:
+            if args.action == 'stop':
+                raise Abort('ino daemon is not running')
+            print 'ino daemon is not running'
+            return
+        try:
+            request(sock, {'control': args.action}, sys.stdout)
+        finally:
+            sock.close()
+
+    def start(self, args):
+        # workers run the compiler launcher by this path from anywhere
+        if os.path.sep in Environment.ino:
+            Environment.ino = os.path.abspath(Environment.ino)
+        server = Server(socket_path(), args.idle_timeout)
+        if args.foreground:
+            server.serve()
+            return
+
+        print 'Starting ino daemon on', socket_path()
+        sys.stdout.flush()
+        if os.fork():
+            return
+        # detach from the terminal and the session completely
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        os.chdir('/')
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            server.serve()
+        finally:
+            os._exit(0)
@@ -1,10 +1,14 @@
 # -*- coding: utf-8; -*-
 
 import sys
+import os.path
 import re
+import hashlib
 
 from ino.commands.base import Command
 from ino.exc import Abort
+from ino.tokenizer import top_level_blocks
+from ino.utils import write_if_changed
 
 
 class Preprocess(Command):
@@ -28,33 +32,71 @@ class Preprocess(Command):
         parser.add_argument('-o', '--output', default='-', help='Output source file name (default: use stdout)')
 
     def run(self, args):
+        sketch = open(args.sketch, 'rt').read()
+        contents = self.preprocess(sketch, args.sketch, self.header())
         if args.output == '-':
-            out = sys.stdout
+            sys.stdout.write(contents)
         else:
-            out = open(args.output, 'wt')
+            write_if_changed(args.output, contents)
 
-        sketch = open(args.sketch, 'rt').read()
+    def header(self):
+        return 'Arduino.h' if self.e.arduino_lib_version.major else 'WProgram.h'
+
+    def preprocess(self, sketch, filename, header):
+        """
+        Return C++ source produced from `sketch` contents. `filename` is
+        used in #line directive so that compiler errors point to the
+        original sketch file.
+        """
         prototypes = self.prototypes(sketch)
         lines = sketch.split('\n')
         includes, lines = self.extract_includes(lines)
 
-        header = 'Arduino.h' if self.e.arduino_lib_version.major else 'WProgram.h'
-        out.write('#include <%s>\n' % header)
+        return ''.join([
+            '#include <%s>\n' % header,
+            '\n'.join(includes), '\n',
+            '\n'.join(prototypes), '\n',
+            '#line 1 "%s"\n' % filename,
+            '\n'.join(lines),
+        ])
 
-        out.write('\n'.join(includes))
-        out.write('\n')
-
-        out.write('\n'.join(prototypes))
-        out.write('\n')
-
-        out.write('#line 1 "%s"\n' % args.sketch)
-        out.write('\n'.join(lines))
+    # a function definition should end with `type name(params)' right
+    # before the opening brace, parameters are without nested parentheses
+    params_regex = re.compile(r'\(([&,\[\]\*\w\s]*)\)\s*\Z')
+    head_regex = re.compile(r'[&\[\]\*\w\s]*')
+    type_regex = re.compile(r'[\w\[\]\*]+')
 
     def prototypes(self, src):
-        src = self.collapse_braces(self.strip(src))
-        regex = re.compile("[\\w\\[\\]\\*]+\\s+[&\\[\\]\\*\\w\\s]+\\([&,\\[\\]\\*\\w\\s]*\\)(?=\\s*\\{)")
-        matches = regex.findall(src)
-        return [m + ';' for m in matches]
+        prototypes = []
+        for code in top_level_blocks(src):
+            signature = self.signature(code)
+            if signature:
+                prototypes.append(signature + ';')
+        return prototypes
+
+    def signature(self, code):
+        """
+        Return function signature `code` preceding a top-level block ends
+        with or None if the block is not a function body.
+        """
+        open_paren = code.rfind('(')
+        if open_paren < 0:
+            return None
+        params = self.params_regex.match(code, open_paren)
+        if not params:
+            return None
+
+        # the head is the trailing part of the code consisting of allowed
+        # characters; it is matched backwards so that it is never rescanned
+        head = code[:open_paren]
+        head = head[len(head) - self.head_regex.match(head[::-1]).end():]
+
+        # the type is the first word followed by whitespace and a name
+        for word in self.type_regex.finditer(head):
+            rest = head[word.end():]
+            if len(rest) > 1 and rest[0].isspace():
+                return head[word.start():] + '(' + params.group(1) + ')'
+        return None
 
     def extract_includes(self, src_lines):
         regex = re.compile("^\\s*#include\\s*[<\"](\\S+)[\">]")
@@ -74,40 +116,26 @@ class Preprocess(Command):
 
         return includes, sketch
 
-    def collapse_braces(self, src):
-        """
-        Remove the contents of all top-level curly brace pairs {}.
-        """
-        result = []
-        nesting = 0;
-
-        for c in src:
-            if not nesting:
-                result.append(c)
-            if c == '{':
-                nesting += 1
-            elif c == '}':
-                nesting -= 1
-                result.append(c)
-        
-        return ''.join(result)
-
-    def strip(self, src):
-        """
-        Strips comments, pre-processor directives, single- and double-quoted
-        strings from a string.
-        """
-        # single-quoted character
-        p = "('.')"
-        
-        # double-quoted string
-        p += "|(\"(?:[^\"\\\\]|\\\\.)*\")"
-        
-        # single and multi-line comment
-        p += "|(//.*?$)|(/\\*[^*]*(?:\\*(?!/)[^*]*)*\\*/)"
-        
-        # pre-processor directive
-        p += "|" + "(^\\s*#.*?$)"
-
-        regex = re.compile(p, re.MULTILINE)
-        return regex.sub(' ', src)
+
+def preprocess_file(task):
+    """
+    Preprocess a single sketch file. `task` is a (source, target, header,
+    digest) tuple where `digest` is the one returned for the previous
+    version of the source or None. Return pair of digest of the source
+    and whether the target has been written.
+
+    The target is left alone if the source is the same as before or the
+    result is identical to the existing one, so that a touched sketch
+    doesn't cause a recompilation. Defined on module level so that it
+    could be run by multiprocessing workers.
+    """
+    source, target, header, previous_digest = task
+    with open(source, 'rt') as f:
+        sketch = f.read()
+
+    digest = hashlib.md5(header + '\0' + sketch).hexdigest()
+    if digest == previous_digest and os.path.exists(target):
+        return digest, False
+
+    contents = Preprocess(None).preprocess(sketch, source, header)
+    return digest, write_if_changed(target, contents)
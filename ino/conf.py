@@ -5,11 +5,28 @@ import os.path
 from configobj import ConfigObj
 
 
+# parsed files by path, reused while they stay the same, e.g. by workers
+# of `ino daemon' forked with the files already parsed
+_parsed = {}
+
+
+def parse(path):
+    path = os.path.abspath(os.path.expanduser(path))
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    cached = _parsed.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _parsed[path] = (mtime, ConfigObj(path))
+    return cached[1]
+
+
 class Configuration(object):
     def __init__(self, *files):
         self.cfg = ConfigObj()
         for f in files:
-            self.cfg.merge(ConfigObj(os.path.expanduser(f)))
+            self.cfg.merge(parse(f))
 
     def as_dict(self, section_name):
         section = self.cfg.get(section_name, ConfigObj())
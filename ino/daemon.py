@@ -0,0 +1,313 @@
+# -*- coding: utf-8; -*-
+
+"""
+Background server keeping ino warm and the client talking to it.
+
+`ino daemon start' runs a server per user listening on a Unix socket.
+While it is up bin/ino sends the command line, the current directory
+and environment variables to the server rather than running a command
+itself. The server has all modules imported and configuration files
+parsed. It forks a worker for every request, so that requests never
+affect each other or the server, and relays output of the worker back
+to the client as it comes. The server exits after a period without
+requests.
+
+This module is imported by bin/ino on every run, so it must not import
+anything heavy on its own.
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import socket
+import struct
+
+
+# commands run by the server; the rest need the terminal or are rare
+commands = ['build', 'clean', 'list-models', 'preproc']
+
+# every response frame is a type byte and payload length followed by
+# the payload: `o' for output and `x' for exit status of the command
+frame_header = struct.Struct('!cI')
+
+
+def cache_dir():
+    # the same as Environment.cache_dir which is too heavy to import here
+    return os.path.join(os.path.expanduser(os.environ.get('XDG_CACHE_HOME', '~/.cache')), 'ino')
+
+
+def socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'ino.sock')
+    return os.path.join(cache_dir(), 'daemon.sock')
+
+
+def to_text(s):
+    # JSON takes unicode only while paths and environment variables are
+    # arbitrary bytes; latin-1 maps every byte to a character and back
+    return s.decode('latin-1')
+
+
+def to_bytes(u):
+    return u.encode('latin-1')
+
+
+def send_frame(sock, kind, payload):
+    sock.sendall(frame_header.pack(kind, len(payload)) + payload)
+
+
+def connect():
+    """
+    Return socket connected to the server or None if it is not running.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def request(sock, message, output):
+    """
+    Send `message` to the server, write output of the command to `output`
+    and return its exit status.
+    """
+    sock.sendall(json.dumps(message) + '\n')
+    f = sock.makefile('rb')
+    while True:
+        header = f.read(frame_header.size)
+        if len(header) < frame_header.size:
+            # the server has gone
+            return 1
+        kind, length = frame_header.unpack(header)
+        payload = f.read(length)
+        if kind == 'o':
+            output.write(payload)
+            output.flush()
+        elif kind == 'x':
+            return int(payload)
+
+
+def run_client(argv):
+    """
+    Run command line `argv` through the server if it is running and
+    the command is served by it. Return exit status or None if the
+    command should be run by this process.
+    """
+    if not argv or argv[0] not in commands:
+        return None
+    sock = connect()
+    if sock is None:
+        return None
+
+    umask = os.umask(0)
+    os.umask(umask)
+    message = {
+        'argv': map(to_text, argv),
+        'cwd': to_text(os.getcwd()),
+        'environ': dict((to_text(k), to_text(v)) for k, v in os.environ.iteritems()),
+        'umask': umask,
+        'tty': sys.stdout.isatty(),
+    }
+    try:
+        return request(sock, message, sys.stdout)
+    except KeyboardInterrupt:
+        # closing the connection makes the server stop the command
+        print 'Terminated by user'
+        return 1
+    finally:
+        sock.close()
+
+
+class Server(object):
+    """
+    Server accepting requests on Unix socket `path` until nothing is
+    requested for `idle_timeout` seconds.
+    """
+
+    def __init__(self, path, idle_timeout):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+        self.last_request = self.started
+        self.workers = set()
+        self.stopping = False
+
+    def warm_up(self):
+        import ino.commands
+        import ino.runner
+        from ino.conf import configure
+
+        for name in commands:
+            ino.commands.load(name)
+        configure()
+
+    def listen(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0077)
+        try:
+            self.listener.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self.listener.listen(16)
+
+    def reap(self):
+        for pid in list(self.workers):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                done = pid
+            if done:
+                self.workers.discard(pid)
+
+    def serve(self):
+        self.warm_up()
+        self.listen()
+        try:
+            while not self.stopping:
+                self.reap()
+                idle = time.time() - self.last_request
+                if idle >= self.idle_timeout and not self.workers:
+                    break
+                ready, _, _ = select.select([self.listener], [], [],
+                                            max(self.idle_timeout - idle, 1))
+                if ready:
+                    conn, _ = self.listener.accept()
+                    self.last_request = time.time()
+                    try:
+                        self.accept(conn)
+                    finally:
+                        conn.close()
+        finally:
+            self.listener.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def accept(self, conn):
+        # a client sends its request right after connecting
+        conn.settimeout(5)
+        try:
+            message = json.loads(conn.makefile('rb').readline())
+        except (socket.error, ValueError):
+            return
+        conn.settimeout(None)
+
+        control = message.get('control')
+        if control == 'stop':
+            self.stopping = True
+            send_frame(conn, 'x', '0')
+        elif control == 'status':
+            send_frame(conn, 'o', 'Serving since %s, pid %d, %d request(s) running\n' % (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                os.getpid(), len(self.workers)))
+            send_frame(conn, 'x', '0')
+        else:
+            pid = os.fork()
+            if pid == 0:
+                self.listener.close()
+                status = 1
+                try:
+                    self.handle(conn, message)
+                    status = 0
+                finally:
+                    os._exit(status)
+            self.workers.add(pid)
+
+    def handle(self, conn, message):
+        """
+        Run the command in a worker and relay its output to the client.
+        Kill the worker if the client disconnects, e.g. on Ctrl+C.
+        """
+        if message.get('tty'):
+            # colorized output is only produced for a terminal
+            read_fd, write_fd = os.openpty()
+        else:
+            read_fd, write_fd = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            conn.close()
+            os.setsid()
+            os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+            os.dup2(write_fd, 1)
+            os.dup2(write_fd, 2)
+            status = 1
+            try:
+                status = self.run(message)
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+
+        while True:
+            ready, _, _ = select.select([read_fd, conn], [], [])
+            if conn in ready:
+                # nothing is ever sent after the request, so it's a disconnect
+                os.killpg(pid, signal.SIGTERM)
+                break
+            try:
+                data = os.read(read_fd, 64 * 1024)
+            except OSError as exc:
+                # a terminal gives EIO once the other side is closed
+                if exc.errno != errno.EIO:
+                    raise
+                data = ''
+            if not data:
+                break
+            send_frame(conn, 'o', data)
+
+        _, status = os.waitpid(pid, 0)
+        if os.WIFSIGNALED(status):
+            code = 128 + os.WTERMSIG(status)
+        else:
+            code = os.WEXITSTATUS(status)
+        try:
+            send_frame(conn, 'x', str(code))
+        except socket.error:
+            pass
+
+    def run(self, message):
+        """
+        Run ino as if it was started with the message's command line in
+        its directory and environment. Return the exit status.
+        """
+        import ino.runner
+        from ino.environment import Environment
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            os.chdir(to_bytes(message['cwd']))
+            os.environ.clear()
+            for key, value in message['environ'].iteritems():
+                os.environ[to_bytes(key)] = to_bytes(value)
+            os.umask(message['umask'])
+            # computed from the environment of the server on import
+            Environment.cache_dir = cache_dir()
+            ino.runner.main(map(to_bytes, message['argv']))
+            code = 0
+        except SystemExit as exc:
+            if exc.code is None or isinstance(exc.code, int):
+                code = exc.code or 0
+            else:
+                sys.stderr.write('%s\n' % exc.code)
+                code = 1
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        return code
@@ -0,0 +1,157 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import re
+import cPickle
+import fnmatch
+import hashlib
+
+from ino.utils import iterdir, makedirs, write_atomically
+
+
+class DistributionMap(object):
+    """
+    Map of files and directories of an Arduino distribution which ino
+    could ever look for: boards.txt files, cores, variants, libraries,
+    version.txt and tools.
+
+    The distribution is walked once. Directories which can't contain
+    anything of interest, e.g. examples, bootloaders or toolchain
+    internals, are pruned. The map is kept in the cache directory and is
+    walked again only if mtime of any directory walked has changed, i.e.
+    if a file has been added or removed.
+    """
+
+    # bump to discard maps saved by older versions
+    version = 1
+
+    # top-level directories walked, everything else is pruned
+    top_dirs = ['hardware', 'lib', 'libraries']
+
+    # directories pruned wherever they are
+    skip_dirs = ['examples', 'reference', 'bootloaders', 'firmwares', 'drivers', 'java']
+
+    # directories whose entries are listed without walking into them
+    shallow_dirs = ['lib', 'libraries']
+
+    # the only directories walked within a toolchain, e.g. hardware/tools/avr
+    tool_dirs = ['bin', 'etc']
+
+    def __init__(self, root):
+        self.root = root
+        # relative path -> whether it is a directory
+        self.entries = {}
+        # relative paths of directories not walked into
+        self.pruned = set()
+        # directory path -> mtime for all directories walked
+        self.stamp = {}
+
+    @classmethod
+    def load(cls, root, cache_dir):
+        """
+        Return map of distribution in `root` either from `cache_dir`
+        or walking the distribution if the cached one is stale.
+        """
+        root = os.path.abspath(root)
+        filepath = os.path.join(cache_dir, 'dists', hashlib.md5(root).hexdigest() + '.pickle')
+        try:
+            with open(filepath, 'rb') as f:
+                version, dist_map = cPickle.load(f)
+            if version == cls.version and dist_map.root == root and not dist_map.is_stale():
+                return dist_map
+        except Exception:
+            pass
+
+        dist_map = cls(root)
+        dist_map.walk()
+        makedirs(os.path.dirname(filepath))
+        write_atomically(filepath, cPickle.dumps((cls.version, dist_map), cPickle.HIGHEST_PROTOCOL))
+        return dist_map
+
+    def is_stale(self):
+        for path, mtime in self.stamp.iteritems():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def prune(self, parts):
+        """
+        Return whether directory with relative path `parts` should be
+        skipped, listed only or walked: 'skip', 'list' or 'walk'.
+        """
+        name = parts[-1]
+        if len(parts) == 1 and name not in self.top_dirs:
+            return 'skip'
+        if name in self.skip_dirs:
+            return 'skip'
+        if len(parts) >= 3 and parts[-3] == 'tools' and name not in self.tool_dirs:
+            return 'skip'
+        if name in self.shallow_dirs:
+            return 'list'
+        return 'walk'
+
+    def walk(self):
+        stack = [()]
+        while stack:
+            parts = stack.pop()
+            path = os.path.join(self.root, *parts)
+            self.stamp[path] = os.path.getmtime(path)
+            mode = self.prune(parts) if parts else 'walk'
+            for entry in iterdir(path):
+                if entry.name.startswith('.'):
+                    continue
+                entry_parts = parts + (entry.name,)
+                rel = os.path.join(*entry_parts)
+                is_dir = entry.is_dir()
+                self.entries[rel] = is_dir
+                if not is_dir:
+                    continue
+                if mode == 'list' or self.prune(entry_parts) == 'skip':
+                    self.pruned.add(rel)
+                else:
+                    stack.append(entry_parts)
+
+    def covers(self, rel):
+        """
+        Return True if the map knows whether relative path `rel` exists,
+        i.e. if it isn't within a pruned directory.
+        """
+        if rel == os.curdir:
+            return True
+        parent = os.path.dirname(rel)
+        while parent:
+            if parent in self.pruned:
+                return False
+            parent = os.path.dirname(parent)
+        return True
+
+    def exists(self, rel):
+        return rel == os.curdir or rel in self.entries
+
+    def glob(self, pattern):
+        """
+        Return sorted list of relative paths of directories matching
+        `pattern` where `**` stands for any number of subdirectories
+        as glob2 does. Pruned directories never match a wildcard.
+        """
+        if not re.search(r'[*?[]', pattern):
+            return [pattern] if self.exists(pattern) else []
+
+        regex = ''
+        for part in pattern.split(os.path.sep):
+            if part == '**':
+                regex += '(?:[^/]+/)*'
+            else:
+                # strip `\Z(?ms)' appended by fnmatch
+                regex += fnmatch.translate(part)[:-7] + '/'
+        regex = re.compile(regex + r'\Z', re.DOTALL)
+
+        result = [rel for rel, is_dir in self.entries.iteritems()
+                  if is_dir and rel not in self.pruned and regex.match(rel + '/')]
+        if regex.match(''):
+            result.append(os.curdir)
+        return sorted(result)
@@ -4,23 +4,20 @@ import sys
 import os.path
 import itertools
 import argparse
-import pickle
+import cPickle
 import platform
 import hashlib
 import re
 
-try:
-    from collections import OrderedDict
-except ImportError:
-    # Python < 2.7
-    from ordereddict import OrderedDict
-
 from collections import namedtuple
 from glob2 import glob
 
+from ino.argparsing import MultipleAction
+from ino.boards import BoardModels, load_index
+from ino.distmap import DistributionMap
 from ino.filters import colorize
-from ino.utils import format_available_options
 from ino.exc import Abort
+from ino.utils import write_atomically
 
 
 class Version(namedtuple('Version', 'major minor build')):
@@ -72,6 +69,9 @@ class Environment(dict):
     lib_dir = 'lib'
     hex_filename = 'firmware.hex'
 
+    # shared between projects, lives across `ino clean'
+    cache_dir = os.path.join(os.path.expanduser(os.environ.get('XDG_CACHE_HOME', '~/.cache')), 'ino')
+
     arduino_dist_dir = None
     arduino_dist_dir_guesses = [
         '/usr/local/share/arduino',
@@ -84,21 +84,111 @@ class Environment(dict):
     default_board_model = 'uno'
     ino = sys.argv[0]
 
+    # properties resolved once by `freeze'
+    frozen_properties = ['hex_path']
+
+    # bump to discard dumps saved by older versions
+    dump_version = 2
+
+    def __init__(self, *args, **kwargs):
+        super(Environment, self).__init__(*args, **kwargs)
+
+        # key -> (Arduino distribution, {path: mtime}) for discovered
+        # items; mtime is None if only existence of the path matters
+        self.stamps = {}
+        self._board_models = None
+        self.dist_maps = {}
+
+        # copy of items and stamps as they are in the dump file
+        self.dumped = None
+
+    def fork(self):
+        """
+        Return a copy of the environment to set up another build with,
+        e.g. of another project. Parsed board models and distribution maps
+        are shared rather than copied.
+        """
+        e = type(self)(self)
+        e.stamps = dict(self.stamps)
+        e._board_models = self._board_models
+        e.dist_maps = self.dist_maps
+        return e
+
+    def adopt(self, other):
+        """
+        Take items discovered by `other` environment, e.g. a fork.
+        """
+        for key, stamp in other.stamps.iteritems():
+            if key in other:
+                self[key] = other[key]
+                self.stamps[key] = stamp
+        if self._board_models is None:
+            self._board_models = other._board_models
+
+    def stamp(self, key, paths, exists_only=False):
+        """
+        Remember that the item `key` was discovered from `paths` so that it
+        is discarded on load once any of them is changed or removed.
+        """
+        self.stamps[key] = (self.get('arduino_dist_dir'), dict(
+            (path, None if exists_only else os.path.getmtime(path)) for path in paths))
+
+    def is_stale(self, key):
+        _, paths = self.stamps[key]
+        for path, mtime in paths.iteritems():
+            try:
+                if mtime is not None and os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+            if mtime is None and not os.path.exists(path):
+                return True
+        return False
+
+    def invalidate(self, key):
+        self.pop(key, None)
+        self.stamps.pop(key, None)
+
     def dump(self):
         if not os.path.isdir(self.output_dir):
             return
-        with open(self.dump_filepath, 'wb') as f:
-            pickle.dump(self.items(), f)
+
+        if (dict(self), self.stamps) == self.dumped:
+            return
+
+        data = cPickle.dumps((self.dump_version, dict(self), self.stamps), cPickle.HIGHEST_PROTOCOL)
+
+        write_atomically(self.dump_filepath, data)
+        self.dumped = cPickle.loads(data)[1:]
 
     def load(self):
         if not os.path.exists(self.dump_filepath):
             return
         with open(self.dump_filepath, 'rb') as f:
-            try:
-                self.update(pickle.load(f))
-            except:
-                print colorize('Environment dump exists (%s), but failed to load' % 
-                               self.dump_filepath, 'yellow')
+            data = f.read()
+        try:
+            dump = cPickle.loads(data)
+        except Exception:
+            print colorize('Environment dump exists (%s), but failed to load' % 
+                           self.dump_filepath, 'yellow')
+            return
+
+        # dumps of older versions are silently discarded
+        if not isinstance(dump, tuple) or dump[0] != self.dump_version:
+            return
+        _, items, stamps = dump
+
+        self.update(items)
+        self.stamps = stamps
+        # unpickle once more to get a copy not shared with items which
+        # could be modified in place
+        self.dumped = cPickle.loads(data)[1:]
+
+        # only items discovered from changed or removed files are
+        # discovered again, everything else is reused
+        for key in self.stamps.keys():
+            if self.is_stale(key):
+                self.invalidate(key)
 
     @property
     def dump_filepath(self):
@@ -123,6 +213,26 @@ class Environment(dict):
     def hex_path(self):
         return os.path.join(self.build_dir, self.hex_filename)
 
+    def freeze(self):
+        """
+        Return read-only snapshot of the environment where items, class
+        attributes and `frozen_properties' are all plain attributes.
+        """
+        values = {}
+        for cls in reversed(type(self).__mro__):
+            if cls in (dict, object):
+                continue
+            for name, value in vars(cls).iteritems():
+                if name.startswith('_') or callable(value) or \
+                        isinstance(value, (property, staticmethod, classmethod)):
+                    continue
+                values[name] = value
+
+        for name in self.frozen_properties:
+            values[name] = getattr(self, name)
+        values.update(self)
+        return FrozenEnvironment(values)
+
     def _find(self, key, items, places, human_name, join, multi):
         """
         Search for file-system entry with any name passed in `items` on
@@ -145,18 +255,19 @@ class Environment(dict):
         places = itertools.chain.from_iterable(os.path.expandvars(p).split(os.pathsep) for p in places)
         places = map(os.path.expanduser, places)
 
-        glob_places = itertools.chain.from_iterable(glob(p) for p in places)
+        glob_places = itertools.chain.from_iterable(self.glob_place(p) for p in places)
         
         print 'Searching for', human_name, '...',
         results = []
         for p in glob_places:
             for i in items:
                 path = os.path.join(p, i)
-                if os.path.exists(path):
+                if self.path_exists(path):
                     result = path if join else p
                     if not multi:
                         print colorize(result, 'green')
                         self[key] = result
+                        self.stamp(key, [result], exists_only=True)
                         return result
                     results.append(result)
 
@@ -168,12 +279,50 @@ class Environment(dict):
                 print colorize(results[0], 'green')
 
             self[key] = results
+            self.stamp(key, results, exists_only=True)
             return results
 
         print colorize('FAILED', 'red')
         raise Abort("%s not found. Searched in following places: %s" %
                     (human_name, ''.join(['\n  - ' + p for p in places])))
 
+    def dist_map(self, path):
+        """
+        Return pair of map of Arduino distribution `path` is within and the
+        path relative to it, or (None, None) if the map doesn't cover the
+        path and the file system should be asked instead.
+        """
+        path = os.path.abspath(path)
+        if 'arduino_dist_dir' in self:
+            roots = [self['arduino_dist_dir']]
+        else:
+            roots = self.arduino_dist_dir_guesses
+
+        for root in roots:
+            root = os.path.abspath(os.path.expanduser(root))
+            if path != root and not path.startswith(root + os.path.sep):
+                continue
+            if root not in self.dist_maps:
+                if not os.path.isdir(root):
+                    continue
+                self.dist_maps[root] = DistributionMap.load(root, self.cache_dir)
+            rel = os.path.relpath(path, root)
+            if self.dist_maps[root].covers(rel):
+                return self.dist_maps[root], rel
+        return None, None
+
+    def glob_place(self, place):
+        dist_map, rel = self.dist_map(place)
+        if dist_map is None:
+            return glob(place)
+        return [os.path.normpath(os.path.join(dist_map.root, p)) for p in dist_map.glob(rel)]
+
+    def path_exists(self, path):
+        dist_map, rel = self.dist_map(path)
+        if dist_map is None:
+            return os.path.exists(path)
+        return dist_map.exists(rel)
+
     def find_dir(self, key, items, places, human_name=None, multi=False):
         return self._find(key, items or ['.'], places, human_name, join=False, multi=multi)
 
@@ -209,8 +358,8 @@ class Environment(dict):
         return [os.path.join(p, *dirname_parts) for p in places]
 
     def board_models(self):
-        if 'board_models' in self:
-            return self['board_models']
+        if self._board_models is not None:
+            return self._board_models
 
         # boards.txt can be placed in following places
         # - hardware/arduino/boards.txt (Arduino IDE 0.xx, 1.0.x)
@@ -221,63 +370,37 @@ class Environment(dict):
                                              human_name='Board description file (boards.txt)',
                                              multi=True)
 
-        self['board_models'] = BoardModels()
-        self['board_models'].default = self.default_board_model
-        for boards_txt in boards_txts:
-            with open(boards_txt) as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith('#'):
-                        continue
-
-                    # Transform lines like:
-                    #   yun.upload.maximum_data_size=2560
-                    # into a nested dict `board_models` so that
-                    #   self['board_models']['yun']['upload']['maximum_data_size'] == 2560
-                    multikey, _, val = line.partition('=')
-                    multikey = multikey.split('.')
-
-                    # traverse into dictionary up to deepest level
-                    # create nested dictionaries if they aren't exist yet
-                    subdict = self['board_models']
-                    for key in multikey[:-1]:
-                        if key not in subdict:
-                            subdict[key] = {}
-                        elif not isinstance(subdict[key], dict):
-                            # it happens that a particular key
-                            # has a value and has sublevels at same time. E.g.:
-                            #   diecimila.menu.cpu.atmega168=ATmega168
-                            #   diecimila.menu.cpu.atmega168.upload.maximum_size=14336
-                            #   diecimila.menu.cpu.atmega168.upload.maximum_data_size=1024
-                            #   diecimila.menu.cpu.atmega168.upload.speed=19200
-                            # place value `ATmega168` into a special key `_` in such case
-                            subdict[key] = {'_': subdict[key]}
-                        subdict = subdict[key]
-
-                    subdict[multikey[-1]] = val
-
-                    # store spectial `_coredir` value on top level so we later can build
-                    # paths relative to a core directory of a specific board model
-                    self['board_models'][multikey[0]]['_coredir'] = os.path.dirname(boards_txt)
-
-        return self['board_models']
+        # models are kept out of the environment dump, only an index of
+        # them is cached and a model is parsed once it is asked for
+        index = load_index(boards_txts, self.cache_dir)
+        self._board_models = BoardModels(index, default=self.default_board_model)
+        return self._board_models
 
     def board_model(self, key):
         return self.board_models()[key]
     
-    def add_board_model_arg(self, parser):
-        help = '\n'.join([
+    def add_board_model_arg(self, parser, multiple=False):
+        help = [
             "Arduino board model (default: %(default)s)",
             "For a full list of supported models run:", 
             "`ino list-models'"
-        ])
+        ]
+        kwargs = {}
+        if multiple:
+            help.append("Several comma-separated models could be given")
+            kwargs = dict(action=MultipleAction, separator=',')
 
         parser.add_argument('-m', '--board-model', metavar='MODEL', 
-                            default=self.default_board_model, help=help)
+                            default=self.default_board_model, help='\n'.join(help), **kwargs)
+
+    def add_arduino_dist_arg(self, parser, multiple=False):
+        help = 'Path to Arduino distribution, e.g. ~/Downloads/arduino-0022.\nTry to guess if not specified'
+        kwargs = {}
+        if multiple:
+            help += '\nCould be given several times'
+            kwargs = dict(action=MultipleAction)
 
-    def add_arduino_dist_arg(self, parser):
-        parser.add_argument('-d', '--arduino-dist', metavar='PATH', 
-                            help='Path to Arduino distribution, e.g. ~/Downloads/arduino-0022.\nTry to guess if not specified')
+        parser.add_argument('-d', '--arduino-dist', metavar='PATH', help=help, **kwargs)
 
     def serial_port_patterns(self):
         system = platform.system()
@@ -307,11 +430,26 @@ class Environment(dict):
         raise Abort("No device matching following was found: %s" %
                     (''.join(['\n  - ' + p for p in self.serial_port_patterns()])))
 
+    def create_project_dirs(self):
+        # For valid projects create .build & lib
+        if not os.path.isdir(self.build_dir):
+            os.makedirs(self.build_dir)
+
+        if not os.path.isdir(self.lib_dir):
+            os.makedirs(self.lib_dir)
+            with open(os.path.join(self.lib_dir, '.holder'), 'w') as f:
+                f.write("")
+
     def process_args(self, args):
         arduino_dist = getattr(args, 'arduino_dist', None)
         if arduino_dist:
             self['arduino_dist_dir'] = arduino_dist
 
+            # forget whatever was discovered in another distribution
+            for key, (dist, _) in self.stamps.items():
+                if dist != arduino_dist:
+                    self.invalidate(key)
+
         board_model = getattr(args, 'board_model', None)
         if board_model:
             all_models = self.board_models()
@@ -340,12 +478,30 @@ class Environment(dict):
                 v_string = f.read().strip()
                 v = Version.parse(v_string)
                 self['arduino_lib_version'] = v
+                self.stamp('arduino_lib_version', [self['version.txt']])
                 print colorize("%s (%s)" % (v, v_string), 'green')
 
         return self['arduino_lib_version']
 
 
-class BoardModels(OrderedDict):
-    def format(self):
-        map = [(key, val['name']) for key, val in self.iteritems() if 'name' in val]
-        return format_available_options(map, head_width=12, default=self.default)
+class FrozenEnvironment(object):
+    """
+    Snapshot of Environment made by `Environment.freeze'. Every lookup is
+    a plain attribute access, there are no misses falling back to getattr
+    as with Environment itself.
+    """
+
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Environment snapshot is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("Environment snapshot is read-only")
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def __contains__(self, key):
+        return key in self.__dict__
@@ -5,7 +5,7 @@ import os.path
 import fnmatch
 import functools
 
-from ino.utils import FileMap, SpaceList
+from ino.utils import FileMap, SpaceList, listdir
 
 
 class GlobFile(object):
@@ -35,17 +35,17 @@ def glob(dir, *patterns, **kwargs):
     subdir = kwargs.get('subdir', '')
 
     result = SpaceList()
-    scan_dir = os.path.join(dir, subdir)
-    if not os.path.isdir(scan_dir):
+    try:
+        listing = listdir(os.path.join(dir, subdir))
+    except OSError:
         return result
 
-    for entry in os.listdir(scan_dir):
-        path = os.path.join(scan_dir, entry)
-        if os.path.isdir(path) and recursive:
+    for entry, kind in listing:
+        if kind == 'dir' and recursive:
             subglob = glob(dir, *patterns, recursive=True,
                            subdir=os.path.join(subdir, entry))
             result.extend(subglob)
-        elif os.path.isfile(path) and any(fnmatch.fnmatch(entry, p) for p in patterns):
+        elif kind == 'file' and any(fnmatch.fnmatch(entry, p) for p in patterns):
             result.append(GlobFile(os.path.join(subdir, entry), dir))
 
     return result
@@ -96,6 +96,27 @@ def libmap(source_dirs, target_dir):
         for source_dir in source_dirs)
 
 
+@filter
+def unity(filemap, members, rename_rule):
+    """
+    Replace sources of `filemap` batched for a unity build with the
+    unity sources. `members` maps path of a batched source to path of
+    its unity source, the latter takes place of its first member.
+    """
+    result = FileMap()
+    seen = set()
+    for source, target in filemap.iteritems():
+        unity_path = members.get(source.path)
+        if unity_path is None:
+            result[source] = target
+        elif unity_path not in seen:
+            seen.add(unity_path)
+            unity_dir, unity_filename = os.path.split(unity_path)
+            result[GlobFile(unity_filename, unity_dir)] = \
+                GlobFile(xname(unity_filename, rename_rule), unity_dir)
+    return result
+
+
 @filter
 def colorize(s, color):
     if not sys.stdout.isatty():
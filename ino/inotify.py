@@ -0,0 +1,189 @@
+# -*- coding: utf-8; -*-
+
+"""
+Watching directory trees for changes with Linux inotify.
+
+inotify is called through ctypes, so nothing has to be compiled or
+installed. On other systems `available' is False.
+"""
+
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    libc.inotify_init1
+    libc.inotify_add_watch
+    libc.inotify_rm_watch
+except (OSError, AttributeError):
+    libc = None
+
+available = libc is not None
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+
+# events which change what files a directory has rather than contents
+STRUCTURE_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | STRUCTURE_EVENTS | IN_ONLYDIR
+
+# struct inotify_event without the trailing name
+event_struct = struct.Struct('iIII')
+
+
+def _check(ret, path=None):
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+    return ret
+
+
+class Inotify(object):
+    """
+    inotify instance watching separate directories.
+    """
+
+    def __init__(self):
+        if libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = _check(libc.inotify_init1(IN_CLOEXEC))
+        # watch descriptor -> directory and back
+        self.paths = {}
+        self.wds = {}
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = _check(libc.inotify_add_watch(self.fd, path, mask), path)
+        self.paths[wd] = path
+        self.wds[path] = wd
+
+    def rm_watch(self, path):
+        wd = self.wds.pop(path, None)
+        if wd is not None:
+            self.paths.pop(wd, None)
+            libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """
+        Return list of (directory, name, mask) triples for events which
+        happened, waiting up to `timeout` seconds for the first of them.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = event_struct.unpack_from(data, pos)
+            pos += event_struct.size
+            name = data[pos:pos + length].rstrip('\0')
+            pos += length
+
+            path = self.paths.get(wd)
+            if mask & IN_IGNORED:
+                # the directory has gone, so has the watch
+                self.paths.pop(wd, None)
+                self.wds.pop(path, None)
+            elif path is not None:
+                events.append((path, name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class TreeWatcher(object):
+    """
+    Watch directory trees recursively, directories created later included.
+    Hidden directories and those named in `exclude` are not watched.
+    """
+
+    def __init__(self, exclude=()):
+        self.inotify = Inotify()
+        self.exclude = exclude
+        self.roots = []
+
+    def skip(self, name):
+        return name.startswith('.') or name in self.exclude
+
+    def ignore(self, name):
+        """
+        Return True for files editors create while saving, e.g. swap and
+        backup files, so that they don't trigger anything.
+        """
+        return name.startswith('.') or name.endswith('~') or \
+            name.endswith(('.swp', '.swx')) or name == '4913'
+
+    def _add_tree(self, root):
+        for dirpath, dirnames, _ in os.walk(root):
+            try:
+                self.inotify.add_watch(dirpath)
+            except OSError:
+                # removed meanwhile
+                dirnames[:] = []
+                continue
+            dirnames[:] = [d for d in dirnames if not self.skip(d)]
+
+    def watch(self, roots):
+        """
+        Make `roots` the trees watched adding and removing watches as
+        necessary.
+        """
+        roots = set(os.path.normpath(r) for r in roots if os.path.isdir(r))
+        # a tree within another one is watched as part of it
+        roots = sorted(r for r in roots if not any(r.startswith(other + os.path.sep) for other in roots))
+        for root in self.roots:
+            if root not in roots:
+                prefix = root + os.path.sep
+                for path in list(self.inotify.wds):
+                    if path == root or path.startswith(prefix):
+                        self.inotify.rm_watch(path)
+        for root in roots:
+            if root not in self.roots:
+                self._add_tree(root)
+        self.roots = roots
+
+    def wait(self, debounce):
+        """
+        Block until anything changes, then keep collecting changes until
+        nothing happens for `debounce` seconds, so that a burst of saves
+        is taken at once. Return pair of set of changed paths and whether
+        any file or directory was created, removed or renamed.
+        """
+        changed = set()
+        structure = False
+        timeout = None
+        while True:
+            events = self.inotify.read(timeout)
+            if not events and changed:
+                return changed, structure
+            for dirpath, name, mask in events:
+                if self.ignore(name):
+                    continue
+                path = os.path.join(dirpath, name) if name else dirpath
+                if mask & STRUCTURE_EVENTS:
+                    structure = True
+                    if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and not self.skip(name):
+                        self._add_tree(path)
+                changed.add(path)
+            if changed:
+                timeout = debounce
+
+    def close(self):
+        self.inotify.close()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8; -*-
+
+import os
+
+
+class JobServer(object):
+    """
+    GNU make jobserver shared by several makes run independently, so that
+    all of them together run no more than `jobs` jobs at once however
+    many of them are running.
+
+    Every make runs one job without asking, any further job takes a token
+    from the pipe and puts it back when finished. So the pipe initially
+    holds a token for every job slot not taken by makes started, and
+    whoever stops starting makes should give its slot away with `release'.
+    """
+
+    def __init__(self, jobs, makes):
+        self.read_fd, self.write_fd = os.pipe()
+        self.release(jobs - makes)
+
+    def release(self, tokens=1):
+        if tokens > 0:
+            os.write(self.write_fd, '+' * tokens)
+
+    def makeflags(self, make_version):
+        """
+        Return MAKEFLAGS making make of `make_version` a client of the
+        jobserver. The option was renamed in GNU Make 4.2.
+        """
+        option = 'jobserver-auth' if make_version >= (4, 2) else 'jobserver-fds'
+        return ' -j --%s=%d,%d' % (option, self.read_fd, self.write_fd)
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
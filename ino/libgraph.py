@@ -0,0 +1,152 @@
+# -*- coding: utf-8; -*-
+
+import os.path
+import pickle
+
+
+class LibraryGraph(object):
+    """
+    Graph of dependencies between a project sources directory and the
+    libraries it uses directly or indirectly.
+
+    For every node the graph keeps libraries it depends on along with
+    mtimes of all files and directories examined to find them out and
+    arbitrary data the scan has produced, e.g. include flags. A node
+    is resolved again only if any of those files has changed, so a rebuild
+    of an unchanged project doesn't scan anything at all.
+
+    The graph could be saved to a file and loaded back. It is discarded
+    if the set of available libraries differs from the saved one, since
+    headers could resolve differently then, and if it was built with
+    another `scan_mode`, since scanners could disagree on dependencies.
+    """
+
+    # bump to discard graphs saved by older versions
+    version = 3
+
+    def __init__(self, lib_dirs, scan_mode=None):
+        self.lib_dirs = list(lib_dirs)
+        self.scan_mode = scan_mode
+        self.nodes = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, filepath, lib_dirs, scan_mode=None):
+        graph = cls(lib_dirs, scan_mode)
+        if not os.path.exists(filepath):
+            return graph
+        try:
+            with open(filepath, 'rb') as f:
+                version, saved_lib_dirs, saved_scan_mode, nodes = pickle.load(f)
+        except Exception:
+            return graph
+        if version == cls.version and saved_lib_dirs == graph.lib_dirs and \
+                saved_scan_mode == scan_mode:
+            graph.nodes = nodes
+        return graph
+
+    def save(self, filepath):
+        if not self.dirty:
+            return
+        with open(filepath, 'wb') as f:
+            pickle.dump((self.version, self.lib_dirs, self.scan_mode, self.nodes), f,
+                        pickle.HIGHEST_PROTOCOL)
+        self.dirty = False
+
+    @staticmethod
+    def stamp(paths):
+        """
+        Return stamp of files and directories to be passed along with
+        node dependencies. Directories should be listed so that added or
+        removed files are noticed too.
+        """
+        return dict((path, os.path.getmtime(path)) for path in paths)
+
+    def is_stale(self, node):
+        if node not in self.nodes:
+            return True
+        stamp = self.nodes[node][1]
+        if stamp is None:
+            return True
+        for path, mtime in stamp.iteritems():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def resolve(self, root, scan):
+        """
+        Find all libraries reachable from `root` node. `scan(node)` is
+        called for unknown or stale nodes and should return a triple of
+        dependency set, stamp and data to be kept. A None stamp means that
+        the node is to be scanned on every resolve.
+        """
+        seen = set([root])
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if self.is_stale(node):
+                deps, stamp, data = scan(node)
+                self.nodes[node] = (frozenset(deps), stamp, data)
+                self.dirty = True
+            for dep in self.nodes[node][0]:
+                if dep not in seen:
+                    seen.add(dep)
+                    stack.append(dep)
+
+    def deps(self, node):
+        return self.nodes[node][0]
+
+    def data(self, node):
+        return self.nodes[node][2]
+
+    def components(self, root):
+        """
+        Return strongly connected components reachable from `root` in
+        reverse topological order, i.e. every component goes after all the
+        components it depends on. Tarjan's algorithm is used.
+        """
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        result = []
+
+        def visit(node):
+            index[node] = lowlink[node] = len(index)
+            stack.append(node)
+            on_stack.add(node)
+
+            for dep in sorted(self.deps(node)):
+                if dep not in index:
+                    visit(dep)
+                    lowlink[node] = min(lowlink[node], lowlink[dep])
+                elif dep in on_stack:
+                    lowlink[node] = min(lowlink[node], index[dep])
+
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.remove(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                result.append(sorted(component))
+
+        visit(root)
+        return result
+
+    def link_order(self, root):
+        """
+        Return pair of libraries reachable from `root` ordered so that
+        every library goes before libraries it depends on, as the linker
+        expects, and a list of dependency cycles found.
+        """
+        components = self.components(root)
+        order = [lib for component in reversed(components)
+                 for lib in component if lib != root]
+        cycles = [component for component in components if len(component) > 1]
+        return order, cycles
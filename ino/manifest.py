@@ -0,0 +1,60 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import pickle
+import hashlib
+
+from ino.utils import write_atomically
+
+
+class BuildManifest(object):
+    """
+    Fingerprint of a successful build: a key made of options the build
+    was run with and mtimes of every file and directory it depended on,
+    i.e. sources, headers, toolchain, boards.txt and the firmware itself.
+
+    If the key is the same and none of the files has changed since, the
+    firmware is up to date and the build could be skipped without
+    rendering Makefiles or running make at all.
+    """
+
+    # bump to discard manifests saved by older versions
+    version = 1
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    @staticmethod
+    def key(parts):
+        return hashlib.md5('\0'.join(map(str, parts))).hexdigest()
+
+    def is_up_to_date(self, key):
+        try:
+            with open(self.filepath, 'rb') as f:
+                version, saved_key, stamp = pickle.load(f)
+        except Exception:
+            return False
+
+        if version != self.version or saved_key != key:
+            return False
+
+        for path, mtime in stamp.iteritems():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def save(self, key, stamp):
+        """
+        Save `key` along with `stamp`, a dictionary of path to mtime pairs.
+        Mtimes should be taken before the build has started so that files
+        changed during the build are not considered up to date.
+        """
+        write_atomically(self.filepath, pickle.dumps((self.version, key, stamp), pickle.HIGHEST_PROTOCOL))
+
+    def discard(self):
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import re
+import errno
+import fcntl
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from contextlib import contextmanager
+from distutils.spawn import find_executable
+
+from ino.exc import Abort
+from ino.utils import makedirs
+
+
+class ObjectCache(object):
+    """
+    Content-addressed storage of compiled object files shared by all
+    projects and build directories.
+
+    An object is looked up by a hash of its preprocessed source, compiler
+    identity and the full list of compiler flags. So once a file is compiled
+    by any project with the same flags, other projects get a ready object
+    without calling the compiler. When total size of stored objects exceeds
+    `max_size` least recently used entries are evicted.
+    """
+
+    # bump to invalidate all existing entries on format changes
+    version = 2
+
+    # dependency files mention the object they were generated for,
+    # it is replaced with this mark in cached copies
+    deps_target_mark = '@INO_TARGET@'
+
+    # on overflow evict entries until this fraction of `max_size` is used
+    cleanup_ratio = 0.8
+
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+
+    def key(self, compiler, args, preprocessed):
+        st = os.stat(compiler)
+        h = hashlib.sha1()
+        h.update('ino-objcache-%d\0' % self.version)
+        h.update('%s\0%d\0%d\0' % (os.path.realpath(compiler), st.st_size, int(st.st_mtime)))
+        for arg in args:
+            h.update(arg + '\0')
+        h.update(preprocessed)
+        return h.hexdigest()
+
+    def entry_path(self, key, ext='.o'):
+        return os.path.join(self.root, key[:2], key[2:] + ext)
+
+    def fetch(self, key, target, deps=None):
+        """
+        Copy cached object to `target` path. If `deps` path is given, the
+        dependency file generated along with the object is restored too.
+        Return False if there is no such entry.
+        """
+        paths = [self.entry_path(key)]
+        try:
+            if deps:
+                paths.append(self.entry_path(key, '.d'))
+                with open(paths[-1]) as f:
+                    contents = f.read().replace(self.deps_target_mark, target, 1)
+                with open(deps, 'w') as f:
+                    f.write(contents)
+            shutil.copyfile(paths[0], target)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+        # refresh mtime so that the entry is considered recently used
+        for path in paths:
+            os.utime(path, None)
+        return True
+
+    def store(self, key, obj_path, deps=None):
+        """
+        Put object from `obj_path` and optionally its dependency file
+        into the cache. Return number of bytes the cache has grown by,
+        an entry replaced is not counted twice.
+        """
+        size = 0
+        if deps:
+            with open(deps) as f:
+                contents = f.read().replace(obj_path, self.deps_target_mark, 1)
+            size += self._store_file(self.entry_path(key, '.d'), contents)
+
+        with open(obj_path, 'rb') as f:
+            size += self._store_file(self.entry_path(key), f.read())
+        return size
+
+    def _store_file(self, path, contents):
+        makedirs(os.path.dirname(path))
+
+        # write under a temporary name first so that concurrent builds
+        # never see a partially written file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(contents)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.rename(tmp_path, path)
+        return len(contents) - replaced
+
+    @contextmanager
+    def stats(self):
+        """
+        Context manager yielding statistics dictionary. Any changes made to
+        it are saved back. The cache is locked for other processes meanwhile.
+        """
+        makedirs(self.root)
+        with open(os.path.join(self.root, 'stats.json'), 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                stats = json.loads(f.read() or '{}')
+            except ValueError:
+                stats = {}
+
+            for field in ('hits', 'misses', 'size', 'evicted'):
+                stats.setdefault(field, 0)
+
+            yield stats
+
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(stats))
+
+    def entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(('.o', '.d')):
+                    path = os.path.join(dirpath, filename)
+                    st = os.stat(path)
+                    yield path, st.st_size, st.st_mtime
+
+    def record_hit(self):
+        with self.stats() as stats:
+            stats['hits'] += 1
+
+    def record_miss(self, size):
+        with self.stats() as stats:
+            stats['misses'] += 1
+            stats['size'] += size
+            if stats['size'] > self.max_size:
+                self._cleanup(stats)
+
+    def _cleanup(self, stats):
+        entries = sorted(self.entries(), key=lambda x: x[2])
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_size * self.cleanup_ratio
+        for path, size, _ in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            stats['evicted'] += 1
+
+        stats['size'] = total
+
+    def clear(self):
+        with self.stats() as stats:
+            for path, _, _ in list(self.entries()):
+                os.remove(path)
+            stats['size'] = 0
+
+    def compile(self, argv):
+        """
+        Run compiler command line `argv` through the cache and return its
+        exit code. Command lines other than `COMPILER ... -o OBJ ... -c SRC'
+        are passed to the compiler as is.
+        """
+        compiler = find_executable(argv[0])
+        args = argv[1:]
+        if not compiler or '-c' not in args or '-o' not in args:
+            return subprocess.call(argv)
+
+        # output paths are specific to a build directory and are
+        # not a part of the key
+        target, key_args = pop_option(args, '-o')
+        deps, key_args = pop_option(key_args, '-MF')
+
+        pp_args = [a for a in key_args if a not in ('-c', '-MD', '-MMD', '-MP')]
+        proc = subprocess.Popen([compiler, '-E'] + pp_args,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        preprocessed, _ = proc.communicate()
+        if proc.returncode != 0:
+            # let the compiler itself report the problem
+            return subprocess.call(argv)
+
+        key = self.key(compiler, key_args, preprocessed)
+        if self.fetch(key, target, deps):
+            self.record_hit()
+            return 0
+
+        ret = subprocess.call(argv)
+        if ret == 0:
+            self.record_miss(self.store(key, target, deps))
+        return ret
+
+
+def pop_option(args, option):
+    """
+    Return value of `option` taking an argument and `args` without both.
+    """
+    if option not in args:
+        return None, args
+    i = args.index(option)
+    return args[i + 1], args[:i] + args[i + 2:]
+
+
+def parse_size(s):
+    """
+    Parse human readable size like `500M' or `5G' into number of bytes.
+    """
+    match = re.match(r'^(\d+(?:\.\d+)?)\s*([KMG]?)B?$', s.strip().upper())
+    if not match:
+        raise Abort("Could not parse size: %s" % s)
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMG'.index(unit or ' '))
+
+
+def format_size(n):
+    units = ['bytes', 'KB', 'MB', 'GB']
+    while n >= 1024 and len(units) > 1:
+        n /= 1024.
+        units.pop(0)
+    return ('%d %s' if units[0] == 'bytes' else '%.1f %s') % (n, units[0])
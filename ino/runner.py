@@ -18,11 +18,9 @@ or mercurial do. The full list is provided below. You may run any of them with
 import sys
 import os.path
 import argparse
-import inspect
 
 import ino.commands
 
-from ino.commands.base import Command
 from ino.conf import configure
 from ino.exc import Abort
 from ino.filters import colorize
@@ -30,48 +28,49 @@ from ino.environment import Environment
 from ino.argparsing import FlexiFormatter
 
 
-def main():
+def main(argv=None):
+    """
+    Run ino with command line `argv`, sys.argv[1:] by default.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
     e = Environment()
     e.load()
 
     conf = configure()
 
     try:
-        current_command = sys.argv[1]
+        current_command = argv[0]
     except IndexError:
         current_command = None
 
     parser = argparse.ArgumentParser(prog='ino', formatter_class=FlexiFormatter, description=__doc__)
     subparsers = parser.add_subparsers()
-    is_command = lambda x: inspect.isclass(x) and issubclass(x, Command) and x != Command
-    commands = [cls(e) for _, cls in inspect.getmembers(ino.commands, is_command)]
-    for cmd in commands:
-        p = subparsers.add_parser(cmd.name, formatter_class=FlexiFormatter, help=cmd.help_line)
-        if current_command != cmd.name:
+    for name, _, _, help_line in ino.commands.registry:
+        p = subparsers.add_parser(name, formatter_class=FlexiFormatter, help=help_line)
+        if current_command != name:
             continue
+        # only the command being run is imported and instantiated
+        cmd = ino.commands.load(name)(e)
         cmd.setup_arg_parser(p)
-        p.set_defaults(func=cmd.run, **conf.as_dict(cmd.name))
+        p.set_defaults(func=cmd.run, **conf.as_dict(name))
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     try:
-        run_anywhere = "init clean list-models serial"
+        run_anywhere = "init clean list-models serial cache daemon"
 
+        # projects of a workspace are looked for by the command itself
         in_project_dir = os.path.isdir(e.src_dir)
-        if not in_project_dir and current_command not in run_anywhere:
+        in_workspace = bool(getattr(args, 'workspace', None))
+        if not in_project_dir and not in_workspace and current_command not in run_anywhere:
             raise Abort("No project found in this directory.")
 
         e.process_args(args)
 
-        if current_command not in run_anywhere:
-            # For valid projects create .build & lib
-            if not os.path.isdir(e.build_dir):                
-                os.makedirs(e.build_dir)
-
-            if not os.path.isdir(e.lib_dir):
-                os.makedirs(e.lib_dir)
-                with open('lib/.holder', 'w') as f:
-                    f.write("")
+        if current_command not in run_anywhere and not in_workspace:
+            e.create_project_dirs()
 
         args.func(args)
     except Abort as exc:
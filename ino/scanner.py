@@ -0,0 +1,232 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import re
+import pickle
+
+from ino.utils import list_subdirs, listdir
+
+
+class HeaderIndex(object):
+    """
+    Index of files found in library directories and all their
+    subdirectories except examples, i.e. in directories passed to the
+    compiler with `-I' flags.
+
+    Directories are listed once when the index is created, then resolving
+    a header name is a dictionary lookup rather than a stat call for every
+    include directory.
+    """
+
+    def __init__(self, lib_dirs):
+        self.include_dirs = []
+        for lib in lib_dirs:
+            self.include_dirs.append(lib)
+            self.include_dirs.extend(list_subdirs(lib, recursive=True, exclude=['examples']))
+
+        self.priority = dict((d, i) for i, d in enumerate(self.include_dirs))
+
+        # file basename -> directories containing it; subdirectories are
+        # not indexed so that e.g. `utility' is not confused with <utility>
+        self.index = {}
+        for d in self.include_dirs:
+            for entry, kind in listdir(d):
+                if kind == 'file' and not entry.startswith('.'):
+                    self.index.setdefault(entry, []).append(d)
+
+        self.resolved = {}
+
+    def resolve(self, name):
+        """
+        Return (path, include_dir) pair for the header `name` as the
+        preprocessor would find it with `-I' flags for all directories
+        indexed, or (None, None) if there is no such header.
+        """
+        if name in self.resolved:
+            return self.resolved[name]
+
+        subdir, basename = os.path.split(os.path.normpath(name))
+        best = None
+        for d in self.index.get(basename, []):
+            # for <utility/twi.h> found in Wire/utility the include
+            # directory is Wire itself
+            if subdir:
+                if not d.endswith(os.path.sep + subdir):
+                    continue
+                d = d[:-len(subdir) - 1]
+                if d not in self.priority:
+                    continue
+            if best is None or self.priority[d] < self.priority[best]:
+                best = d
+
+        result = (os.path.join(best, name), best) if best is not None else (None, None)
+        self.resolved[name] = result
+        return result
+
+
+class IncludeScanner(object):
+    """
+    Find out which libraries are used by sources without running the
+    compiler.
+
+    #include directives are read with a regex and resolved against library
+    directories the same way the preprocessor resolves them against `-I'
+    flags: every library directory and all its subdirectories except
+    examples are searched in order. Included headers are scanned
+    recursively, so libraries used by other libraries' headers are found
+    too.
+
+    Conditional compilation is not taken into account: a header included
+    under a false #if is considered used as well.
+
+    Directives found in each file are memoized by the file mtime and could
+    be persisted between runs with `save'.
+    """
+
+    # bump to discard caches saved by older versions
+    version = 3
+
+    regex = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\n]+)[>"]', re.MULTILINE)
+
+    # #include with a macro instead of a literal header name
+    computed_regex = re.compile(r'^[ \t]*#[ \t]*include[ \t]*[^<" \t\n]', re.MULTILINE)
+
+    def __init__(self, lib_dirs, cache_filepath=None):
+        self.lib_dirs = lib_dirs
+        self.cache_filepath = cache_filepath
+        self.cache = self._load()
+        self.dirty = False
+        self.headers_index = HeaderIndex(lib_dirs)
+        self.owners = {}
+        self.quoted = {}
+
+    def _load(self):
+        if not self.cache_filepath or not os.path.exists(self.cache_filepath):
+            return {}
+        try:
+            with open(self.cache_filepath, 'rb') as f:
+                version, cache = pickle.load(f)
+        except Exception:
+            return {}
+        return cache if version == self.version else {}
+
+    def save(self):
+        if not self.cache_filepath or not self.dirty:
+            return
+        with open(self.cache_filepath, 'wb') as f:
+            pickle.dump((self.version, self.cache), f, pickle.HIGHEST_PROTOCOL)
+        self.dirty = False
+
+    def directives(self, path):
+        """
+        Return pair of a list of (delimiter, name) pairs for #include
+        directives of the file and a flag telling whether the file has
+        computed #include directives which couldn't be resolved.
+        """
+        # absolute paths as keys let projects share the memo
+        key = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        cached = self.cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path) as f:
+            contents = f.read()
+        directives = (self.regex.findall(contents), bool(self.computed_regex.search(contents)))
+        self.cache[key] = (mtime, directives)
+        self.dirty = True
+        return directives
+
+    def includes(self, path):
+        return self.directives(path)[0]
+
+    def resolve(self, name, quote_dirs=()):
+        """
+        Return (path, include_dir) pair for the header `name`. Include
+        directory is None if the header is found in one of `quote_dirs`.
+        Return (None, None) if the header is not provided by any library,
+        e.g. if it is a system header.
+        """
+        for d in quote_dirs:
+            path = os.path.normpath(os.path.join(d, name))
+            if path not in self.quoted:
+                self.quoted[path] = os.path.isfile(path)
+            if self.quoted[path]:
+                return path, None
+
+        return self.headers_index.resolve(name)
+
+    def owner(self, path):
+        """
+        Return library directory the file belongs to or None.
+        """
+        if path not in self.owners:
+            self.owners[path] = None
+            for lib in self.lib_dirs:
+                if path.startswith(lib + os.path.sep):
+                    self.owners[path] = lib
+                    break
+        return self.owners[path]
+
+    def _walk(self, sources):
+        """
+        Return pair of set of headers included by `sources` directly or
+        through other headers and ordered list of include directories
+        they were found in. The latter is None if any of the files
+        examined has computed #include directives.
+        """
+        seen = set()
+        include_dirs = set()
+        computed = False
+        stack = list(sources)
+        while stack:
+            path, quote_dir = stack.pop()
+            quote_dirs = [d for d in (os.path.dirname(path), quote_dir) if d is not None]
+            includes, has_computed = self.directives(path)
+            computed = computed or has_computed
+            for delimiter, name in includes:
+                header, include_dir = self.resolve(name, quote_dirs if delimiter == '"' else ())
+                if include_dir is not None:
+                    include_dirs.add(include_dir)
+                if header and header not in seen:
+                    seen.add(header)
+                    stack.append((header, None))
+
+        if computed:
+            return seen, None
+        return seen, sorted(include_dirs, key=self.headers_index.priority.get)
+
+    def headers(self, sources):
+        """
+        Return set of headers included by `sources` directly or through
+        other headers. `sources` is a list of (path, quote_dir) pairs where
+        `quote_dir` is an additional directory to search "quoted" headers
+        in after the one of the source itself, or None.
+        """
+        return self._walk(sources)[0]
+
+    def include_dirs(self, source, quote_dir=None):
+        """
+        Return list of include directories the source needs to be
+        compiled in the order they should be passed to the compiler, or
+        None if it couldn't be determined.
+        """
+        return self._walk([(source, quote_dir)])[1]
+
+    def libs(self, headers, exclude=None):
+        """
+        Return set of library directories `headers` belong to except
+        `exclude` one.
+        """
+        libs = set(self.owner(h) for h in headers)
+        libs.discard(None)
+        libs.discard(exclude)
+        return libs
+
+    def used_libs(self, sources, exclude=None):
+        """
+        Return set of library directories used by `sources` except
+        `exclude` one.
+        """
+        return self.libs(self.headers(sources), exclude)
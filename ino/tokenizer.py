@@ -0,0 +1,124 @@
+# -*- coding: utf-8; -*-
+
+import re
+
+
+# runs of characters which never start a comment, a literal, a directive,
+# a newline or change brace nesting
+chunk_regex = re.compile(r'[^"\'/{};#\n]+')
+
+string_regex = re.compile(r'"[^"\\\n]*(?:\\.[^"\\\n]*)*"', re.DOTALL)
+char_regex = re.compile(r"'[^'\\\n]*(?:\\.[^'\\\n]*)*'", re.DOTALL)
+raw_delimiter_regex = re.compile(r'([^()\\\s]{0,16})\(')
+directive_regex = re.compile(r'#[^\n\\]*(?:\\.[^\n\\]*)*', re.DOTALL)
+
+raw_prefixes = ('R', 'u8R', 'uR', 'UR', 'LR')
+
+
+def word_before(src, pos):
+    """
+    Return identifier or number immediately preceding `pos`.
+    """
+    start = pos
+    while start > 0 and (src[start - 1].isalnum() or src[start - 1] in '_.'):
+        start -= 1
+    return src[start:pos]
+
+
+def top_level_blocks(src):
+    """
+    Yield code preceding every top-level `{' in C/C++ `src` since the
+    previous `;', `{' or `}' on the top level.
+    """
+    for code, terminator in top_level_statements(src):
+        if terminator == '{':
+            yield code
+
+
+def top_level_statements(src, descend=None):
+    """
+    Yield (code, terminator) pairs for every top-level `;' or `{' in
+    C/C++ `src` where `code` is everything since the previous `;', `{'
+    or `}' on the top level. Comments, string and char literals including
+    raw strings and preprocessor directives are replaced with spaces.
+    Contents of blocks are skipped entirely unless `descend(code)` is
+    true for the block, e.g. a namespace; then its statements are yielded
+    as top-level ones followed by ('', '}') for its end.
+
+    Source is scanned once, all the work per character is done by regular
+    expressions which never backtrack, so it takes linear time.
+    """
+    n = len(src)
+    pos = 0
+    line_start = 0
+    depth = 0
+    # blocks descended into which are open now
+    descended = 0
+    code = []
+
+    while pos < n:
+        c = src[pos]
+        end = pos + 1
+        piece = c
+
+        if c == '\n':
+            line_start = end
+        elif c == '{':
+            if depth == 0:
+                block = ''.join(code)
+                yield block, c
+                code = []
+                if descend is not None and descend(block):
+                    descended += 1
+                else:
+                    depth += 1
+            else:
+                depth += 1
+        elif c == '}':
+            if depth == 0 and descended:
+                descended -= 1
+                yield '', c
+            depth = max(depth - 1, 0)
+            code = []
+        elif c == ';':
+            if depth == 0:
+                yield ''.join(code), c
+            code = []
+        elif c == '/' and src.startswith('//', pos):
+            end = src.find('\n', pos)
+            end = n if end < 0 else end
+            piece = ' '
+        elif c == '/' and src.startswith('/*', pos):
+            end = src.find('*/', pos + 2)
+            end = n if end < 0 else end + 2
+            piece = ' '
+        elif c == '"':
+            match = None
+            if word_before(src, pos) in raw_prefixes:
+                match = raw_delimiter_regex.match(src, end)
+            if match:
+                end = src.find(')' + match.group(1) + '"', match.end())
+                end = n if end < 0 else end + len(match.group(1)) + 2
+            else:
+                match = string_regex.match(src, pos)
+                end = match.end() if match else end
+            piece = ' '
+        elif c == "'":
+            # an apostrophe within a number is a digit separator
+            if not word_before(src, pos)[:1].isdigit():
+                match = char_regex.match(src, pos)
+                end = match.end() if match else end
+                piece = ' '
+        elif c == '#':
+            if not src[line_start:pos].strip():
+                end = directive_regex.match(src, pos).end()
+                piece = ' '
+        else:
+            # a lone `/', `#' or `'' is taken as is
+            match = chunk_regex.match(src, pos)
+            end = match.end() if match else end
+            piece = src[pos:end]
+
+        if depth == 0 and c not in '{};':
+            code.append(piece)
+        pos = end
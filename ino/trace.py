@@ -0,0 +1,151 @@
+# -*- coding: utf-8; -*-
+
+"""
+Timing of builds in the Chrome trace event format, which could be
+loaded in chrome://tracing or https://ui.perfetto.dev.
+
+Phases of a build are timed by ino itself. Compile, archive and link
+jobs are run by make, so when tracing every such job is run through
+this very file as a launcher:
+
+    python trace.py JOBS PID CATEGORY TARGET -- COMMAND...
+
+It runs the command and appends its timing to the JOBS file which is
+collected when the trace is saved. It is run as a script rather than
+as a module so that it imports nothing but the standard library.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+from contextlib import contextmanager
+
+
+def now():
+    # microseconds of the same clock in all processes
+    return int(time.time() * 1000000)
+
+
+def assign_slots(jobs):
+    """
+    Set `tid' of every job event to the number of the job slot which ran
+    it: make doesn't tell which of its slots runs a job, so jobs are laid
+    out in as few slots as possible, which is how many were busy at once.
+    """
+    ends = []
+    for job in sorted(jobs, key=lambda job: job['ts']):
+        for slot, end in enumerate(ends):
+            if end <= job['ts']:
+                break
+        else:
+            slot = len(ends)
+            ends.append(0)
+        ends[slot] = job['ts'] + job['dur']
+        job['tid'] = slot + 1
+    return len(ends)
+
+
+class Tracer(object):
+    """
+    Trace of a single ino run written to `path`, or nothing recorded if
+    `path` is None. Every build traced, e.g. for a board model of a
+    matrix, is shown as a separate process.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+        self.processes = []
+        self.jobs_path = None
+        if path is not None:
+            fd, self.jobs_path = tempfile.mkstemp(prefix='ino-trace-', suffix='.jsonl')
+            os.close(fd)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def process(self, label):
+        """
+        Return trace pid for the build labeled `label`.
+        """
+        self.processes.append(label)
+        return len(self.processes)
+
+    @contextmanager
+    def phase(self, name, pid=1):
+        start = now()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.events.append({'name': name, 'cat': 'phase', 'ph': 'X',
+                                    'ts': start, 'dur': now() - start,
+                                    'pid': pid, 'tid': 0})
+
+    def launcher(self, pid):
+        """
+        Return prefix of a make recipe command for the build with trace
+        `pid` to be followed by category, target and `--'.
+        """
+        if not self.enabled:
+            return []
+        script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        return [sys.executable, script, self.jobs_path, str(pid)]
+
+    def jobs(self):
+        if not self.enabled:
+            return []
+        with open(self.jobs_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def save(self):
+        if not self.enabled:
+            return
+
+        jobs = self.jobs()
+        metadata = []
+        for pid, label in enumerate(self.processes or ['ino build'], 1):
+            slots = assign_slots([job for job in jobs if job['pid'] == pid])
+            metadata.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                             'args': {'name': label}})
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                             'args': {'name': 'ino'}})
+            for tid in range(1, slots + 1):
+                metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                 'args': {'name': 'job slot %d' % tid}})
+
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': metadata + self.events + jobs,
+                       'displayTimeUnit': 'ms'}, f)
+
+    def close(self):
+        if self.jobs_path is not None and os.path.exists(self.jobs_path):
+            os.remove(self.jobs_path)
+
+
+def main(argv):
+    jobs_path, pid, category, target = argv[:4]
+    command = argv[5:]
+    start = now()
+    ret = subprocess.call(command)
+    event = {'name': os.path.basename(target), 'cat': category, 'ph': 'X',
+             'ts': start, 'dur': now() - start, 'pid': int(pid),
+             'args': {'target': target, 'command': ' '.join(command),
+                      'status': ret}}
+    # a single write to a file opened for appending is never mixed
+    # with ones of jobs running at the same time
+    fd = os.open(jobs_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, json.dumps(event) + '\n')
+    finally:
+        os.close(fd)
+    return ret
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,183 @@
+# -*- coding: utf-8; -*-
+
+"""
+Support for unity builds, i.e. compiling several sources as a single
+translation unit which #includes them all.
+
+Sources can't always be merged: a static function, a type or a macro
+defined in one of them could clash with a name in another. Every source
+is examined with the tokenizer and those which could clash with sources
+already batched are left to be compiled separately. Only the file scope,
+named namespaces and linkage specifications are examined, so a source
+with an anonymous namespace is never batched.
+"""
+
+import re
+
+from ino.tokenizer import top_level_statements
+
+
+define_regex = re.compile(r'^[ \t]*#[ \t]*define[ \t]+(\w+)', re.MULTILINE)
+word_regex = re.compile(r'[A-Za-z_]\w*')
+
+# name being declared: the identifier followed by a parameter list,
+# an initializer, array bounds or the end of the declaration
+name_regex = re.compile(r'(?<![:\w])([A-Za-z_]\w*)\s*(?:\[[^\]]*\]\s*)*(?:\(|=|$)')
+# name of a pointer to function or array, e.g. `void (*handler)(int)'
+pointer_regex = re.compile(r'\(\s*\*\s*([A-Za-z_]\w*)\s*\)')
+# a struct, class, union or enum body possibly followed by declarators
+type_block_regex = re.compile(r'^(?:(?:typedef|static|const|volatile)\s+)*(?:struct|class|union|enum)\b')
+type_regex = re.compile(r'^(?:(?:typedef|static|const|volatile)\s+)*(?:struct|class|union|enum)\s+'
+                        r'(?:class\s+)?(\w+)')
+typedef_regex = re.compile(r'^typedef\b')
+static_regex = re.compile(r'\bstatic\b')
+const_regex = re.compile(r'^(?:(?:static|volatile|unsigned|signed)\s+)*const(?:expr)?\b')
+anonymous_namespace_regex = re.compile(r'^(?:inline\s+)?namespace$')
+named_namespace_regex = re.compile(r'^(?:inline\s+)?namespace\s+([\w:]+)$')
+# the string literal of `extern "C"' is blanked out by the tokenizer
+linkage_regex = re.compile(r'^extern$')
+
+
+def split_declarators(code):
+    """
+    Split declaration `code` on commas which are not within parentheses,
+    brackets or template arguments, e.g. `static int a, b[2] = {1, 2}'.
+    """
+    parts = []
+    depth = 0
+    start = 0
+    for pos, c in enumerate(code):
+        if c in '([{<':
+            depth += 1
+        elif c in ')]}>':
+            depth = max(depth - 1, 0)
+        elif c == ',' and depth == 0:
+            parts.append(code[start:pos])
+            start = pos + 1
+    parts.append(code[start:])
+    return parts
+
+
+def declarator_name(declarator):
+    match = pointer_regex.search(declarator) or name_regex.search(declarator)
+    return match.group(1) if match else None
+
+
+def block_scope(code):
+    """
+    Return prefix of names declared in the block opened by `code` if it
+    is a named namespace or a linkage specification, None otherwise.
+    """
+    code = ' '.join(code.split())
+    match = named_namespace_regex.match(code)
+    if match:
+        return match.group(1) + '::'
+    if linkage_regex.match(code):
+        return ''
+    return None
+
+
+class Symbols(object):
+    """
+    File scope names of a single source which matter for merging.
+    Names declared within namespaces are qualified with them.
+    """
+
+    def __init__(self, src, cplusplus=True):
+        # all names declared on the file scope
+        self.declared = set()
+        # names with internal linkage including types
+        self.internal = set()
+        self.macros = set(define_regex.findall(src))
+        self.words = set(word_regex.findall(src))
+        self.mergeable = True
+
+        # prefixes of namespaces the statement is within
+        scopes = []
+        # specifiers of a type whose body has just ended, they apply to
+        # names declared after it, e.g. `typedef struct { ... } Point;'
+        carried = ''
+        descend = lambda code: block_scope(code) is not None
+        for code, terminator in top_level_statements(src, descend):
+            if terminator == '}':
+                scopes.pop()
+                continue
+            code = ' '.join(code.split())
+            if terminator == '{' and anonymous_namespace_regex.match(code):
+                self.mergeable = False
+                continue
+            if terminator == '{' and descend(code):
+                scopes.append(block_scope(code))
+                continue
+            prefix = ''.join(scopes)
+
+            if terminator == '{':
+                carried = ''
+                if type_block_regex.match(code):
+                    carried = code
+                    match = type_regex.match(code)
+                    if match:
+                        self.declared.add(prefix + match.group(1))
+                        self.internal.add(prefix + match.group(1))
+                    continue
+                if code.endswith('='):
+                    # an initializer list, more declarators could follow it
+                    names = [declarator_name(d) for d in split_declarators(code)]
+                    carried = code
+                else:
+                    # a function definition
+                    names = [declarator_name(code)]
+                context = code
+            else:
+                names = [declarator_name(d) for d in split_declarators(code)]
+                context = (carried + ' ' + code).strip()
+                carried = ''
+
+            internal = bool(typedef_regex.match(context) or static_regex.search(context) or
+                            (cplusplus and const_regex.match(context)))
+            for name in names:
+                if name is None:
+                    continue
+                self.declared.add(prefix + name)
+                if internal:
+                    self.internal.add(prefix + name)
+
+    def clashes(self, other):
+        return bool(self.internal & other.declared or
+                    self.declared & other.internal or
+                    self.macros & other.words or
+                    other.macros & self.words)
+
+    def update(self, other):
+        self.declared |= other.declared
+        self.internal |= other.internal
+        self.macros |= other.macros
+        self.words |= other.words
+
+
+def partition(sources):
+    """
+    Split `sources` into a list of sources which could be compiled as
+    a single translation unit and a list of sources to be compiled
+    separately. Order of sources is kept, the earlier source wins a clash.
+    """
+    batch, separate = [], []
+    batch_symbols = Symbols('')
+    for source in sources:
+        with open(source) as f:
+            symbols = Symbols(f.read(), cplusplus=not source.endswith('.c'))
+        if not symbols.mergeable or symbols.clashes(batch_symbols):
+            separate.append(source)
+        else:
+            batch.append(source)
+            batch_symbols.update(symbols)
+    return batch, separate
+
+
+def unity_source(sources):
+    """
+    Return contents of a source which includes all the `sources`.
+    """
+    lines = ['/* generated by ino build --unity */']
+    lines.extend('#include "%s"' % source for source in sources)
+    return '\n'.join(lines) + '\n'
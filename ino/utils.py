@@ -1,7 +1,11 @@
 # -*- coding: utf-8; -*-
 
 import os.path
+import errno
 import itertools
+import multiprocessing
+
+from contextlib import contextmanager
 
 
 try:
@@ -10,6 +14,16 @@ except ImportError:
     # Python < 2.7
     from ordereddict import OrderedDict
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Python < 3.5, the backport is listed in requirements.txt
+        from scandir import scandir
+    except ImportError:
+        # installed without requirements, e.g. run from a checkout
+        scandir = None
+
 
 class SpaceList(list):
     def __add__(self, other):
@@ -37,10 +51,76 @@ class FileMap(OrderedDict):
         return SpaceList(x.path for x in self.targets())
 
 
+class DirSnapshot(object):
+    """
+    Listings of directories read once and shared by everything walking
+    the same trees, e.g. the `glob' filter and `list_subdirs'. A snapshot
+    is used by them while it is current, i.e. within `with' block:
+
+        with DirSnapshot() as snapshot:
+            ...
+
+    Directories changed meanwhile should be invalidated explicitly.
+    """
+
+    current = None
+
+    def __init__(self):
+        self.listings = {}
+        self.previous = None
+
+    def __enter__(self):
+        self.previous, DirSnapshot.current = DirSnapshot.current, self
+        return self
+
+    def __exit__(self, *exc_info):
+        DirSnapshot.current = self.previous
+
+    def listdir(self, dirname):
+        dirname = os.path.normpath(dirname)
+        if dirname not in self.listings:
+            self.listings[dirname] = read_dir(dirname)
+        return self.listings[dirname]
+
+    def invalidate(self, path):
+        """
+        Forget listings of `path` and all its parents, e.g. after a file
+        has been created there possibly along with new directories.
+        """
+        path = os.path.normpath(path)
+        while path:
+            self.listings.pop(path, None)
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+
+
+def read_dir(dirname):
+    """
+    Return list of (name, kind) pairs for entries of `dirname` where
+    kind is 'dir', 'file' or None for anything else.
+    """
+    listing = []
+    for entry in iterdir(dirname):
+        kind = 'dir' if entry.is_dir() else 'file' if entry.is_file() else None
+        listing.append((entry.name, kind))
+    return listing
+
+
+def listdir(dirname):
+    """
+    Return listing of `dirname` as `read_dir` does, from the current
+    DirSnapshot if any.
+    """
+    if DirSnapshot.current is not None:
+        return DirSnapshot.current.listdir(dirname)
+    return read_dir(dirname)
+
+
 def list_subdirs(dirname, recursive=False, exclude=[]):
-    entries = [e for e in os.listdir(dirname) if e not in exclude and not e.startswith('.')]
-    paths = [os.path.join(dirname, e) for e in entries]
-    dirs = filter(os.path.isdir, paths)
+    dirs = [os.path.join(dirname, name) for name, kind in listdir(dirname)
+            if kind == 'dir' and name not in exclude and not name.startswith('.')]
     if recursive:
         sub = itertools.chain.from_iterable(
             list_subdirs(d, recursive=True, exclude=exclude) for d in dirs)
@@ -48,6 +128,101 @@ def list_subdirs(dirname, recursive=False, exclude=[]):
     return dirs
 
 
+class DirEntry(object):
+    """
+    Minimal stand-in for entries yielded by scandir when it is not
+    available. Unlike real entries it stats the file for every check.
+    """
+
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+
+def iterdir(dirname):
+    """
+    Return iterator over entries of `dirname` with `name`, `path`,
+    `is_dir()` and `is_file()` like scandir does, using scandir if
+    possible so that file types are known without extra stat calls.
+    """
+    if scandir is not None:
+        return scandir(dirname)
+    return (DirEntry(dirname, name) for name in os.listdir(dirname))
+
+
+def makedirs(path):
+    """
+    Like os.makedirs but doesn't fail if the directory already exists,
+    e.g. has been just created by a concurrent process.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+@contextmanager
+def working_dir(path):
+    """
+    Make `path` the current directory within `with' block, unless it is
+    None which stands for the current directory itself.
+    """
+    if path is None:
+        yield
+        return
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def write_if_changed(path, contents):
+    """
+    Write `contents` to `path` unless the file already has exactly this
+    contents, so that its mtime is left alone and make doesn't rebuild
+    anything depending on it. Return True if the file was written.
+    """
+    try:
+        if os.path.getsize(path) == len(contents):
+            with open(path, 'rb') as f:
+                if f.read() == contents:
+                    return False
+    except OSError:
+        pass
+
+    with open(path, 'wb') as f:
+        f.write(contents)
+    return True
+
+
+def write_atomically(path, contents):
+    """
+    Write `contents` to a temporary file next to `path` and rename it,
+    so that concurrently running ino processes never read a partially
+    written file.
+    """
+    tmp_path = '%s.%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(contents)
+    os.rename(tmp_path, path)
+
+
+def cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
 def format_available_options(items, head_width, head_color='cyan', 
                              default=None, default_mark="[DEFAULT]", 
                              default_mark_color='red'):
@@ -0,0 +1,64 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+from ino.boards import BoardModels, load_index
+
+
+class TestBoardModels(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.avr = self.write('avr/boards.txt', '\n'.join([
+            '# comment',
+            'menu.cpu=Processor',
+            'uno.name=Arduino Uno',
+            'uno.build.mcu=atmega328p',
+            'diecimila.name=Arduino Diecimila',
+            'diecimila.menu.cpu.atmega168=ATmega168',
+            'diecimila.menu.cpu.atmega168.upload.speed=19200',
+        ]))
+        self.extra = self.write('extra/boards.txt', 'uno.build.f_cpu=16000000L\n')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, filename, contents):
+        path = os.path.join(self.tmp_dir, filename)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_index(self):
+        index = load_index([self.avr, self.extra], self.cache_dir)
+        assert_equal(index.keys(), ['menu', 'uno', 'diecimila'])
+        assert_equal(index['uno'], ('Arduino Uno', [self.avr, self.extra]))
+        assert_equal(index['menu'], (None, [self.avr]))
+
+    def test_lazy_parsing(self):
+        models = BoardModels(load_index([self.avr, self.extra], self.cache_dir))
+        assert_true('uno' in models)
+        assert_false('mega' in models)
+        assert_equal(models.parsed, {})
+        assert_equal(models['uno'], {
+            'name': 'Arduino Uno',
+            'build': {'mcu': 'atmega328p', 'f_cpu': '16000000L'},
+            '_coredir': os.path.dirname(self.extra),
+        })
+        assert_equal(models['diecimila']['menu']['cpu'],
+                     {'atmega168': {'_': 'ATmega168', 'upload': {'speed': '19200'}}})
+        assert_equal(sorted(models.parsed), ['diecimila', 'uno'])
+
+    def test_index_rebuilt_on_change(self):
+        load_index([self.avr], self.cache_dir)
+        with open(self.avr, 'a') as f:
+            f.write('\nmega.name=Arduino Mega\n')
+        st = os.stat(self.avr)
+        os.utime(self.avr, (st.st_atime, st.st_mtime + 1))
+        assert_true('mega' in load_index([self.avr], self.cache_dir))
@@ -0,0 +1,194 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import fcntl
+import shutil
+import tempfile
+
+import argparse
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+from ino.commands.build import Build
+from ino.environment import Environment
+from ino.utils import SpaceList
+
+
+class TestIncludesFirst(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def includes_first(self, contents):
+        path = os.path.join(self.tmp_dir, 'source.cpp')
+        with open(path, 'w') as f:
+            f.write(contents)
+        return Build(None).includes_first(path, 'Arduino.h')
+
+    def test_core_header_first(self):
+        assert_true(self.includes_first('#include <Arduino.h>\nint x;\n'))
+        assert_true(self.includes_first('// comment\n/* block\n */\n#include "Arduino.h"\n'))
+
+    def test_something_else_first(self):
+        assert_false(self.includes_first('#define X 1\n#include <Arduino.h>\n'))
+        assert_false(self.includes_first('#include "config.h"\n#include <Arduino.h>\n'))
+        assert_false(self.includes_first('int x;\n'))
+
+
+class TestMatrix(object):
+    def parse(self, argv):
+        parser = argparse.ArgumentParser()
+        Environment().add_board_model_arg(parser, multiple=True)
+        Environment().add_arduino_dist_arg(parser, multiple=True)
+        return parser.parse_args(argv)
+
+    def test_single_target(self):
+        args = self.parse([])
+        assert_equal(args.board_model, 'uno')
+        assert_equal(Build(None).matrix(args), [(None, 'uno', None)])
+
+    def test_models_and_dists(self):
+        args = self.parse(['-m', 'uno,mega2560', '-d', 'a', '-d', 'b', '-m', 'uno'])
+        assert_equal(args.board_model, 'uno')
+        assert_equal(args.arduino_dist, 'a')
+        assert_equal(Build(None).matrix(args),
+                     [(None, 'uno', 'a'), (None, 'mega2560', 'a'),
+                      (None, 'uno', 'b'), (None, 'mega2560', 'b')])
+
+    def test_relative_dist_in_workspace(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(tmp_dir, 'alpha', 'src'))
+            args = self.parse(['-d', 'arduino', '-d', '/opt/arduino'])
+            args.workspace = tmp_dir
+            assert_equal(Build(Environment()).matrix(args),
+                         [(os.path.join(tmp_dir, 'alpha'), 'uno', os.path.abspath('arduino')),
+                          (os.path.join(tmp_dir, 'alpha'), 'uno', '/opt/arduino')])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestFindProjects(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for path in ('alpha/src', 'alpha/lib/x/src', 'group/beta/src', '.hidden/src', 'docs'):
+            os.makedirs(os.path.join(self.tmp_dir, path))
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_projects_found(self):
+        projects = Build(Environment()).find_projects(self.tmp_dir)
+        assert_equal(projects, [os.path.join(self.tmp_dir, 'alpha'),
+                                os.path.join(self.tmp_dir, 'group', 'beta')])
+
+
+class TestForgetPrebuilt(object):
+    def setup(self):
+        e = Environment()
+        e['prebuilt_dirs'] = ['/dist/cores/arduino', '/dist/libraries/SPI']
+        self.build = Build(e)
+        self.key = ('prebuilt', '/cache/prebuilt/v1/x', ('/dist/libraries/SPI',))
+        self.build.shared[self.key] = True
+
+    def test_project_change_keeps_prebuilt(self):
+        self.build.forget_prebuilt(set(['src/sketch.ino', '/dist/libraries/SPIx/SPIx.h']))
+        assert_true(self.key in self.build.shared)
+
+    def test_library_change_forgets_prebuilt(self):
+        self.build.forget_prebuilt(set(['src/sketch.ino', '/dist/libraries/SPI/SPI.cpp']))
+        assert_false(self.key in self.build.shared)
+
+
+class TestPrebuiltStore(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.e = self.environment('dist')
+        self.args = argparse.Namespace(no_prebuilt=False)
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir, *parts)
+
+    def environment(self, dist):
+        for d in ('hardware/arduino/cores/arduino', 'libraries/SPI', 'lib', 'bin'):
+            if not os.path.isdir(self.path(dist, d)):
+                os.makedirs(self.path(dist, d))
+        with open(self.path(dist, 'lib', 'version.txt'), 'w') as f:
+            f.write('1.0.5\n')
+        e = Environment()
+        e['arduino_dist_dir'] = self.path(dist)
+        e['arduino_core_dir'] = self.path(dist, 'hardware/arduino/cores/arduino')
+        e['arduino_libraries_dir'] = self.path(dist, 'libraries')
+        e['cppflags'] = SpaceList(['-mmcu=atmega328p', '-Os'])
+        e['cflags'] = SpaceList()
+        e['cxxflags'] = SpaceList(['-fno-exceptions'])
+        for tool in ('cc', 'cxx', 'ar'):
+            e[tool] = self.path(dist, 'bin', 'avr-' + tool)
+            open(e[tool], 'w').close()
+        return e
+
+    def prebuilt_dir(self, e=None):
+        build = Build(e or self.e)
+        build.setup_prebuilt(self.args)
+        return build.e.prebuilt_dir
+
+    def test_same_setup_same_store(self):
+        assert_equal(self.prebuilt_dir(), self.prebuilt_dir())
+
+    def test_key_depends_on_flags(self):
+        before = self.prebuilt_dir()
+        self.e['cppflags'] = SpaceList(['-mmcu=atmega2560', '-Os'])
+        assert_true(self.prebuilt_dir() != before)
+        self.e['cppflags'] = SpaceList(['-mmcu=atmega328p', '-Os'])
+        self.e['cxxflags'] = SpaceList()
+        assert_true(self.prebuilt_dir() != before)
+
+    def test_key_depends_on_toolchain(self):
+        before = self.prebuilt_dir()
+        os.utime(self.e.cxx, (1000, 1000))
+        assert_true(self.prebuilt_dir() != before)
+
+    def test_key_depends_on_distribution(self):
+        assert_true(self.prebuilt_dir(self.environment('other')) != self.prebuilt_dir())
+        # a library added to the distribution changes include flags
+        before = self.prebuilt_dir()
+        os.makedirs(self.path('dist', 'libraries', 'Wire'))
+        assert_true(self.prebuilt_dir() != before)
+
+    def test_no_prebuilt(self):
+        self.args.no_prebuilt = True
+        assert_equal(self.prebuilt_dir(), None)
+
+    def test_made_once_under_lock(self):
+        build = Build(self.e)
+        self.e['prebuilt_dir'] = self.path('store')
+        self.e['prebuilt_dirs'] = [self.e.arduino_core_dir]
+        self.e['prebuilt_libs'] = [self.e.arduino_core_dir]
+        build.prebuilt_makefile = 'Makefile.prebuilt'
+        made = []
+
+        def run_make(makefile):
+            # nobody else could take the lock meanwhile
+            with open(self.path('store', '.lock')) as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = False
+                except IOError:
+                    locked = True
+            made.append((makefile, locked))
+        build.run_make = run_make
+
+        build.make_prebuilt()
+        build.make_prebuilt()
+        assert_equal(made, [('Makefile.prebuilt', True)])
+
+        # a change within the libraries makes it be made again
+        build.forget_prebuilt([os.path.join(self.e.arduino_core_dir, 'main.cpp')])
+        build.make_prebuilt()
+        assert_equal(len(made), 2)
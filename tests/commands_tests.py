@@ -0,0 +1,13 @@
+# -*- coding: utf-8; -*-
+
+from nose.tools import assert_equal
+
+import ino.commands
+
+
+class TestRegistry(object):
+    def test_matches_command_classes(self):
+        for name, _, _, help_line in ino.commands.registry:
+            cls = ino.commands.load(name)
+            assert_equal(cls.name, name)
+            assert_equal(cls.help_line, help_line)
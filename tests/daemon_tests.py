@@ -0,0 +1,85 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import json
+import time
+import shutil
+import socket
+import tempfile
+import StringIO
+
+from nose.tools import assert_equal, assert_false
+
+from ino.daemon import Server, connect, request, send_frame, run_client, socket_path
+
+
+class TestRequest(object):
+    def setup(self):
+        self.client, self.server = socket.socketpair()
+        self.output = StringIO.StringIO()
+
+    def teardown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_output_and_status(self):
+        send_frame(self.server, 'o', 'Linking ')
+        send_frame(self.server, 'o', 'firmware.elf\n')
+        send_frame(self.server, 'x', '2')
+        status = request(self.client, {'argv': ['build']}, self.output)
+        assert_equal(status, 2)
+        assert_equal(self.output.getvalue(), 'Linking firmware.elf\n')
+        message = json.loads(self.server.makefile('rb').readline())
+        assert_equal(message, {'argv': ['build']})
+
+    def test_server_gone(self):
+        send_frame(self.server, 'o', 'Scanning')
+        self.server.shutdown(socket.SHUT_WR)
+        status = request(self.client, {'argv': ['build']}, self.output)
+        assert_equal(status, 1)
+        assert_equal(self.output.getvalue(), 'Scanning')
+
+
+def test_run_client_local_commands():
+    assert_equal(run_client([]), None)
+    assert_equal(run_client(['upload']), None)
+
+
+class TestServer(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.saved_environ = dict(os.environ)
+        self.saved_cwd = os.getcwd()
+        os.environ['XDG_RUNTIME_DIR'] = self.tmp_dir
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmp_dir, 'cache')
+
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                Server(socket_path(), idle_timeout=30).serve()
+            finally:
+                os._exit(0)
+        for _ in range(500):
+            if os.path.exists(socket_path()):
+                break
+            time.sleep(0.01)
+
+    def teardown(self):
+        os.chdir(self.saved_cwd)
+        sock = connect()
+        if sock is not None:
+            request(sock, {'control': 'stop'}, StringIO.StringIO())
+            sock.close()
+        os.waitpid(self.pid, 0)
+        os.environ.clear()
+        os.environ.update(self.saved_environ)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_non_ascii_cwd_and_environment(self):
+        project = os.path.join(self.tmp_dir, '\xd0\xbf\xd1\x80\xd0\xbe\xd0\xb5\xd0\xba\xd1\x82')
+        os.makedirs(os.path.join(project, '.build'))
+        os.chdir(project)
+        os.environ['INO_TEST'] = '\xff'
+        assert_equal(run_client(['clean']), 0)
+        assert_false(os.path.exists(os.path.join(project, '.build')))
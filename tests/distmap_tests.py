@@ -0,0 +1,61 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+from ino.distmap import DistributionMap
+
+
+class TestDistributionMap(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'arduino')
+        for filename in ['hardware/arduino/boards.txt',
+                         'hardware/arduino/cores/arduino/Arduino.h',
+                         'hardware/arduino/bootloaders/optiboot/boards.txt',
+                         'hardware/tools/avr/bin/avr-gcc',
+                         'hardware/tools/avr/avr/include/stdio.h',
+                         'libraries/SPI/SPI.h',
+                         'lib/version.txt',
+                         'reference/index.html']:
+            self.write(filename)
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, filename):
+        path = os.path.join(self.root, filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('')
+
+    def test_glob(self):
+        dist_map = DistributionMap.load(self.root, self.cache_dir)
+        assert_equal(dist_map.glob('hardware/**'), [
+            'hardware', 'hardware/arduino', 'hardware/arduino/cores',
+            'hardware/arduino/cores/arduino', 'hardware/tools',
+            'hardware/tools/avr', 'hardware/tools/avr/bin'])
+        assert_equal(dist_map.glob('hardware/*/cores'), ['hardware/arduino/cores'])
+        assert_equal(dist_map.glob('libraries'), ['libraries'])
+
+    def test_pruned(self):
+        dist_map = DistributionMap.load(self.root, self.cache_dir)
+        assert_true(dist_map.exists('hardware/tools/avr/bin/avr-gcc'))
+        assert_true(dist_map.exists('libraries/SPI'))
+        assert_false(dist_map.exists('hardware/arduino/variants'))
+        assert_true(dist_map.covers('hardware/arduino/variants'))
+        assert_false(dist_map.covers('libraries/SPI/SPI.h'))
+        assert_false(dist_map.covers('hardware/tools/avr/avr/include'))
+        assert_false(dist_map.covers('reference/index.html'))
+
+    def test_walked_again_on_change(self):
+        DistributionMap.load(self.root, self.cache_dir)
+        self.write('hardware/arduino/variants/standard/pins_arduino.h')
+        dist_map = DistributionMap.load(self.root, self.cache_dir)
+        assert_true(dist_map.exists('hardware/arduino/variants/standard'))
@@ -1,8 +1,13 @@
 # -*- coding: utf-8; -*-
 
-from nose.tools import assert_equal
+import os
+import os.path
+import shutil
+import tempfile
 
-from ino.environment import Version
+from nose.tools import assert_equal, assert_raises, assert_true, assert_false
+
+from ino.environment import Version, Environment
 
 
 class TestVersion(object):
@@ -18,3 +23,84 @@ class TestVersion(object):
         assert_equal(Version(1, 0, 0).as_int(), 100)
         assert_equal(Version(1, 0, 5).as_int(), 105)
         assert_equal(Version(1, 5, 1).as_int(), 151)
+
+
+class TestFrozenEnvironment(object):
+    def test_snapshot(self):
+        e = Environment(build_dir='.build/uno', cc='/usr/bin/avr-gcc')
+        frozen = e.freeze()
+        assert_equal(frozen.cc, '/usr/bin/avr-gcc')
+        assert_equal(frozen['cc'], '/usr/bin/avr-gcc')
+        assert_equal(frozen.src_dir, 'src')
+        assert_equal(frozen.hex_path, '.build/uno/firmware.hex')
+        assert_raises(AttributeError, getattr, frozen, 'cxx')
+        assert_raises(AttributeError, setattr, frozen, 'cc', 'gcc')
+
+
+class TestFork(object):
+    def test_discoveries_adopted(self):
+        base = Environment(cc='/usr/bin/avr-gcc')
+        fork = base.fork()
+        assert_equal(fork.cc, '/usr/bin/avr-gcc')
+
+        fork['build_dir'] = '.build/uno'
+        fork['cxx'] = __file__
+        fork.stamp('cxx', [__file__], exists_only=True)
+        base.adopt(fork)
+        assert_equal(base.cxx, __file__)
+        assert_true('build_dir' not in base)
+
+
+class TestEnvironmentDump(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tool = os.path.join(self.tmp_dir, 'avr-gcc')
+        self.version_txt = os.path.join(self.tmp_dir, 'version.txt')
+        for path in (self.tool, self.version_txt):
+            with open(path, 'w') as f:
+                f.write('')
+
+        e = self.environment()
+        e['cc'] = self.tool
+        e.stamp('cc', [self.tool], exists_only=True)
+        e['arduino_lib_version'] = Version(1, 0, 5)
+        e.stamp('arduino_lib_version', [self.version_txt])
+        e.dump()
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def environment(self):
+        e = Environment()
+        e.output_dir = self.tmp_dir
+        return e
+
+    def test_fresh(self):
+        e = self.environment()
+        e.load()
+        assert_equal(e.cc, self.tool)
+        assert_equal(e['arduino_lib_version'], (1, 0, 5))
+
+    def test_stale_entries_invalidated(self):
+        st = os.stat(self.version_txt)
+        os.utime(self.version_txt, (st.st_atime, st.st_mtime + 1))
+        os.utime(self.tool, (st.st_atime, st.st_mtime + 1))
+        e = self.environment()
+        e.load()
+        assert_equal(e.cc, self.tool)
+        assert_true('arduino_lib_version' not in e)
+
+        os.remove(self.tool)
+        e = self.environment()
+        e.load()
+        assert_true('cc' not in e)
+
+    def test_written_only_if_changed(self):
+        e = self.environment()
+        e.load()
+        os.remove(e.dump_filepath)
+        e.dump()
+        assert_false(os.path.exists(e.dump_filepath))
+        e['cxx'] = self.tool
+        e.dump()
+        assert_true(os.path.exists(e.dump_filepath))
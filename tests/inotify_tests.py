@@ -0,0 +1,53 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equal, assert_true, assert_false
+
+import ino.inotify
+
+
+class TestTreeWatcher(object):
+    def setup(self):
+        if not ino.inotify.available:
+            raise SkipTest('inotify is not available')
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(self.path('src', 'util'))
+        self.write('src', 'util', 'util.c')
+        self.watcher = ino.inotify.TreeWatcher()
+        self.watcher.watch([self.path('src'), self.path('src', 'util')])
+
+    def teardown(self):
+        self.watcher.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir, *parts)
+
+    def write(self, *parts):
+        with open(self.path(*parts), 'w') as f:
+            f.write('int x;\n')
+
+    def test_changes_coalesced(self):
+        self.write('src', 'util', 'util.c')
+        self.write('src', 'util', '.util.c.swp')
+        self.write('src', 'main.cpp')
+        changed, structure = self.watcher.wait(0.05)
+        assert_equal(changed, set([self.path('src', 'util', 'util.c'), self.path('src', 'main.cpp')]))
+        assert_true(structure)
+
+        self.write('src', 'main.cpp')
+        changed, structure = self.watcher.wait(0.05)
+        assert_equal(changed, set([self.path('src', 'main.cpp')]))
+        assert_false(structure)
+
+    def test_new_directories_watched(self):
+        os.makedirs(self.path('src', 'new'))
+        self.watcher.wait(0.05)
+        self.write('src', 'new', 'new.c')
+        changed, _ = self.watcher.wait(0.05)
+        assert_true(self.path('src', 'new', 'new.c') in changed)
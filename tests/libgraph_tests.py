@@ -0,0 +1,89 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true
+
+from ino.libgraph import LibraryGraph
+
+
+def scanner(deps):
+    calls = []
+    def scan(node):
+        calls.append(node)
+        return deps.get(node, []), {}, None
+    return scan, calls
+
+
+class TestLibraryGraph(object):
+    def test_link_order(self):
+        graph = LibraryGraph(['a', 'b', 'c', 'd'])
+        scan, _ = scanner({'src': ['a', 'c'], 'a': ['b', 'c'], 'b': ['d'], 'c': ['d']})
+        graph.resolve('src', scan)
+        order, cycles = graph.link_order('src')
+        assert_equal(sorted(order), ['a', 'b', 'c', 'd'])
+        for lib, deps in [('a', 'bc'), ('b', 'd'), ('c', 'd')]:
+            for dep in deps:
+                assert_true(order.index(lib) < order.index(dep))
+        assert_equal(cycles, [])
+
+    def test_cycles(self):
+        graph = LibraryGraph(['a', 'b', 'c'])
+        scan, _ = scanner({'src': ['a'], 'a': ['b'], 'b': ['a', 'c']})
+        graph.resolve('src', scan)
+        order, cycles = graph.link_order('src')
+        assert_equal(order, ['a', 'b', 'c'])
+        assert_equal(cycles, [['a', 'b']])
+
+    def test_only_stale_rescanned(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            header = os.path.join(tmp_dir, 'a.h')
+            open(header, 'w').close()
+            graph_filepath = os.path.join(tmp_dir, 'graph.pickle')
+
+            def scan(node):
+                calls.append(node)
+                stamp = LibraryGraph.stamp([header]) if node == 'a' else {}
+                return {'src': ['a', 'b']}.get(node, []), stamp, None
+
+            calls = []
+            graph = LibraryGraph(['a', 'b'])
+            graph.resolve('src', scan)
+            graph.save(graph_filepath)
+
+            os.utime(header, (0, 0))
+            calls = []
+            graph = LibraryGraph.load(graph_filepath, ['a', 'b'])
+            graph.resolve('src', scan)
+            assert_equal(calls, ['a'])
+
+            # other set of libraries invalidates everything
+            calls = []
+            graph = LibraryGraph.load(graph_filepath, ['a', 'b', 'c'])
+            graph.resolve('src', scan)
+            assert_equal(sorted(calls), ['a', 'b', 'src'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_other_scan_mode_discarded(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            graph_filepath = os.path.join(tmp_dir, 'graph.pickle')
+            # the built-in scanner misses a dependency the compiler finds
+            builtin, _ = scanner({'src': ['a']})
+            compiler, calls = scanner({'src': ['a', 'b']})
+
+            graph = LibraryGraph(['a', 'b'], 'builtin')
+            graph.resolve('src', builtin)
+            graph.save(graph_filepath)
+
+            graph = LibraryGraph.load(graph_filepath, ['a', 'b'], 'compiler')
+            graph.resolve('src', compiler)
+            assert_equal(sorted(calls), ['a', 'b', 'src'])
+            assert_equal(sorted(graph.deps('src')), ['a', 'b'])
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_true, assert_false
+
+from ino.libgraph import LibraryGraph
+from ino.manifest import BuildManifest
+
+
+class TestBuildManifest(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, 'main.cpp')
+        with open(self.source, 'w') as f:
+            f.write('')
+        self.manifest = BuildManifest(os.path.join(self.tmp_dir, 'manifest.pickle'))
+        self.manifest.save('key', LibraryGraph.stamp([self.source]))
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_up_to_date(self):
+        assert_true(self.manifest.is_up_to_date('key'))
+        assert_false(self.manifest.is_up_to_date('other key'))
+
+    def test_changed_file(self):
+        st = os.stat(self.source)
+        os.utime(self.source, (st.st_atime, st.st_mtime + 1))
+        assert_false(self.manifest.is_up_to_date('key'))
+
+    def test_removed_file(self):
+        os.remove(self.source)
+        assert_false(self.manifest.is_up_to_date('key'))
+        self.manifest.discard()
+        assert_false(os.path.exists(self.manifest.filepath))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+from ino.objcache import ObjectCache, parse_size
+
+
+class TestObjectCache(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = ObjectCache(os.path.join(self.tmp_dir, 'cache'), max_size=250)
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_object(self, name, size):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as f:
+            f.write('x' * size)
+        return path
+
+    def test_fetch_stored(self):
+        obj = self.make_object('a.o', 10)
+        self.cache.record_miss(self.cache.store('ab01', obj))
+
+        target = os.path.join(self.tmp_dir, 'b.o')
+        assert_true(self.cache.fetch('ab01', target))
+        assert_equal(open(target).read(), 'x' * 10)
+        assert_false(self.cache.fetch('ab02', target))
+
+    def test_deps_target_substituted(self):
+        obj = self.make_object('a.o', 10)
+        deps = os.path.join(self.tmp_dir, 'a.d')
+        with open(deps, 'w') as f:
+            f.write('%s: a.cpp a.h\na.h:\n' % obj)
+        self.cache.store('ab01', obj, deps)
+
+        target = os.path.join(self.tmp_dir, 'other', 'b.o')
+        os.makedirs(os.path.dirname(target))
+        target_deps = os.path.join(self.tmp_dir, 'other', 'b.d')
+        assert_true(self.cache.fetch('ab01', target, target_deps))
+        assert_equal(open(target_deps).read(), '%s: a.cpp a.h\na.h:\n' % target)
+
+    def test_stored_again(self):
+        obj = self.make_object('a.o', 10)
+        deps = os.path.join(self.tmp_dir, 'a.d')
+        with open(deps, 'w') as f:
+            f.write('%s: a.cpp\n' % obj)
+        self.cache.record_miss(self.cache.store('ab01', obj, deps))
+        self.cache.record_miss(self.cache.store('ab01', self.make_object('a.o', 15), deps))
+        with self.cache.stats() as stats:
+            assert_equal(stats['size'], sum(size for _, size, _ in self.cache.entries()))
+
+    def test_lru_eviction(self):
+        for i, key in enumerate(['aa01', 'aa02', 'aa03']):
+            path = self.cache.entry_path(key)
+            self.cache.record_miss(self.cache.store(key, self.make_object(key, 100)))
+            os.utime(path, (1000 + i, 1000 + i))
+
+        # the oldest entry was evicted to fit 80% of max size
+        assert_false(os.path.exists(self.cache.entry_path('aa01')))
+        assert_true(os.path.exists(self.cache.entry_path('aa03')))
+        with self.cache.stats() as stats:
+            assert_equal(stats['misses'], 3)
+            assert_equal(stats['evicted'], 1)
+            assert_equal(stats['size'], 200)
+
+
+def test_parse_size():
+    assert_equal(parse_size('100'), 100)
+    assert_equal(parse_size('2K'), 2048)
+    assert_equal(parse_size('1.5M'), 1536 * 1024)
+    assert_equal(parse_size('5g'), 5 * 1024 ** 3)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true
+
+from ino.commands.preproc import Preprocess, preprocess_file
+from ino.tokenizer import top_level_blocks
+
+
+class TestPrototypes(object):
+    def prototypes(self, src):
+        return Preprocess(None).prototypes(src)
+
+    def test_functions(self):
+        src = '\n'.join([
+            'void setup() {',
+            '}',
+            'unsigned long  bar(int a[], int &b)',
+            '{',
+            '    if (a) { return 0; }',
+            '}',
+            'class A {',
+            '    void method() { }',
+            '};',
+            'int x = 3; void* ptr(byte *p) { }',
+        ])
+        assert_equal(self.prototypes(src), [
+            'void setup();',
+            'unsigned long  bar(int a[], int &b);',
+            'void* ptr(byte *p);',
+        ])
+
+    def test_literals_and_comments(self):
+        src = '\n'.join([
+            '// void commented() {}',
+            '/* void block() { */',
+            'const char *s = "void str() {\\" {";',
+            'const char *r = R"x(void raw() { )" )x";',
+            "char c = '{', q = '\\'', d = '\\\\';",
+            "long n = 1'000'000;",
+            '#define BODY(a) \\',
+            '    void macro() { a }',
+            'void real() {',
+            '}',
+        ])
+        assert_equal(self.prototypes(src), ['void real();'])
+
+    def test_blocks(self):
+        blocks = list(top_level_blocks('int t[] = {1, 2};\nstruct S {\n};\n  #if X\nvoid f() {}\n#endif\n'))
+        assert_equal([b.strip() for b in blocks], ['int t[] =', 'struct S', 'void f()'])
+
+
+class TestPreprocessFile(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, 'sketch.ino')
+        self.target = os.path.join(self.tmp_dir, 'sketch.cpp')
+        self.write('void setup() {\n}\n')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, contents):
+        with open(self.source, 'w') as f:
+            f.write(contents)
+
+    def test_unchanged_output_not_written(self):
+        digest, written = preprocess_file((self.source, self.target, 'Arduino.h', None))
+        assert_true(written)
+        assert_equal(preprocess_file((self.source, self.target, 'Arduino.h', digest)), (digest, False))
+        assert_equal(preprocess_file((self.source, self.target, 'Arduino.h', None)), (digest, False))
+
+        self.write('void setup() {\n  \n}\n')
+        assert_true(preprocess_file((self.source, self.target, 'Arduino.h', digest))[1])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+from ino.scanner import IncludeScanner
+
+
+class TestIncludeScanner(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.write('core/Arduino.h', '#include <stdint.h>\n')
+        self.write('libs/Wire/Wire.h', '#include "utility/twi.h"\n')
+        self.write('libs/Wire/utility/twi.h', '#include <utility>\n')
+        self.write('libs/SPI/SPI.h', '  #  include <Wire.h>\n')
+        self.write('libs/SPI/SPI.cpp', '#include "SPI.h"\n')
+        self.write('libs/Servo/Servo.h', '')
+        self.write('libs/Servo/examples/Sweep/Sweep.h', '')
+        self.write('src/local.h', '#include <Arduino.h>\n')
+        self.write('src/main.cpp', '#include "local.h"\n#include <SPI.h>\n#include <Sweep.h>\n')
+
+        self.libs = [self.path('core')] + [self.path('libs', lib) for lib in ('Wire', 'SPI', 'Servo')]
+        self.scanner = IncludeScanner(self.libs, self.path('cache.pickle'))
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir, *parts)
+
+    def write(self, filename, contents):
+        path = self.path(filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def test_transitive_libs(self):
+        used = self.scanner.used_libs([(self.path('src', 'main.cpp'), None)])
+        assert_equal(used, set([self.path('core'), self.path('libs', 'SPI'), self.path('libs', 'Wire')]))
+
+    def test_exclude_self(self):
+        used = self.scanner.used_libs([(self.path('libs', 'SPI', 'SPI.cpp'), None)],
+                                      exclude=self.path('libs', 'SPI'))
+        assert_equal(used, set([self.path('libs', 'Wire')]))
+
+    def test_subdirectory_is_not_header(self):
+        assert_equal(self.scanner.resolve('utility'), (None, None))
+        assert_equal(self.scanner.resolve('utility/twi.h'),
+                     (self.path('libs', 'Wire', 'utility', 'twi.h'), self.path('libs', 'Wire')))
+
+    def test_include_dirs(self):
+        assert_equal(self.scanner.include_dirs(self.path('libs', 'SPI', 'SPI.cpp')),
+                     [self.path('libs', 'Wire')])
+        assert_equal(self.scanner.include_dirs(self.path('src', 'main.cpp')),
+                     [self.path('core'), self.path('libs', 'Wire'), self.path('libs', 'SPI')])
+
+    def test_computed_include(self):
+        self.write('src/computed.cpp', '#include <SPI.h>\n#include HEADER\n')
+        assert_equal(self.scanner.include_dirs(self.path('src', 'computed.cpp')), None)
+
+    def test_cache_persisted(self):
+        self.scanner.includes(self.path('src', 'main.cpp'))
+        self.scanner.save()
+        scanner = IncludeScanner(self.libs, self.path('cache.pickle'))
+        assert_equal(scanner.includes(self.path('src', 'main.cpp')),
+                     [('"', 'local.h'), ('<', 'SPI.h'), ('<', 'Sweep.h')])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8; -*-
+
+import os
+import json
+import tempfile
+
+from nose.tools import assert_equal
+
+from ino.trace import Tracer, assign_slots, main
+
+
+def job(ts, dur):
+    return {'ts': ts, 'dur': dur}
+
+
+class TestAssignSlots(object):
+    def test_sequential_jobs_share_slot(self):
+        jobs = [job(0, 10), job(10, 5), job(20, 1)]
+        assert_equal(assign_slots(jobs), 1)
+        assert_equal([j['tid'] for j in jobs], [1, 1, 1])
+
+    def test_overlapping_jobs(self):
+        jobs = [job(0, 10), job(5, 10), job(12, 3), job(16, 1)]
+        assert_equal(assign_slots(jobs), 2)
+        assert_equal([j['tid'] for j in jobs], [1, 2, 1, 1])
+
+    def test_free_slot_reused(self):
+        jobs = [job(0, 100), job(1, 2), job(2, 10), job(5, 1)]
+        assert_equal(assign_slots(jobs), 3)
+        assert_equal([j['tid'] for j in jobs], [1, 2, 3, 2])
+
+
+class TestTracer(object):
+    def setup(self):
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.tracer = Tracer(self.path)
+
+    def teardown(self):
+        self.tracer.close()
+        os.remove(self.path)
+
+    def test_phases_and_jobs(self):
+        pid = self.tracer.process('uno')
+        with self.tracer.phase('discover', pid):
+            pass
+        launcher = self.tracer.launcher(pid)
+        assert_equal(main(launcher[2:] + ['link', 'build/firmware.elf', '--', 'true']), 0)
+        self.tracer.save()
+
+        with open(self.path) as f:
+            events = json.load(f)['traceEvents']
+        names = [(e['ph'], e['name'], e['pid'], e['tid']) for e in events]
+        assert_equal(names, [
+            ('M', 'process_name', 1, 0),
+            ('M', 'thread_name', 1, 0),
+            ('M', 'thread_name', 1, 1),
+            ('X', 'discover', 1, 0),
+            ('X', 'firmware.elf', 1, 1),
+        ])
+        assert_equal(events[-1]['cat'], 'link')
+
+    def test_disabled(self):
+        tracer = Tracer()
+        with tracer.phase('discover'):
+            pass
+        assert_equal(tracer.launcher(1), [])
+        assert_equal(tracer.events, [])
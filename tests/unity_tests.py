@@ -0,0 +1,107 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+from ino.unity import Symbols, partition
+
+
+class TestSymbols(object):
+    def test_file_scope(self):
+        symbols = Symbols('\n'.join([
+            '#define LED 13',
+            'static int counter = 0;',
+            'const char names[] = "abc";',
+            'struct Point { int x; };',
+            'int value() { static int local; return local; }',
+            'void Foo::method() { }',
+        ]))
+        assert_equal(symbols.declared, set(['counter', 'names', 'Point', 'value']))
+        assert_equal(symbols.internal, set(['counter', 'names', 'Point']))
+        assert_equal(symbols.macros, set(['LED']))
+        assert_true(symbols.mergeable)
+
+    def test_const_in_c(self):
+        symbols = Symbols('const int limit = 3;', cplusplus=False)
+        assert_equal(symbols.internal, set())
+
+    def test_anonymous_namespace(self):
+        assert_false(Symbols('namespace { int x; }').mergeable)
+        assert_true(Symbols('namespace foo { int x; }').mergeable)
+
+    def test_namespaces(self):
+        symbols = Symbols('\n'.join([
+            'namespace util {',
+            '  static int counter;',
+            '  struct State { int x; };',
+            '  namespace detail { const int limit = 3; }',
+            '  int shared();',
+            '}',
+            'extern "C" {',
+            '  static void isr() { }',
+            '}',
+            'static int after;',
+        ]))
+        assert_equal(symbols.declared, set(['util::counter', 'util::State', 'util::detail::limit',
+                                            'util::shared', 'isr', 'after']))
+        assert_equal(symbols.internal, set(['util::counter', 'util::State',
+                                            'util::detail::limit', 'isr', 'after']))
+        assert_false(Symbols('namespace util { namespace { int x; } }').mergeable)
+
+    def test_declarators(self):
+        symbols = Symbols('\n'.join([
+            'static int cnt, *total = 0, sums[2] = {1, 2};',
+            'typedef struct { int x; } Point, *PointPtr;',
+            'static struct { int y; } state;',
+            'typedef void (*handler)(int, char);',
+            'int f(int a, int b);',
+        ]))
+        assert_equal(symbols.declared, set(['cnt', 'total', 'sums', 'Point', 'PointPtr',
+                                            'state', 'handler', 'f']))
+        assert_equal(symbols.internal, set(['cnt', 'total', 'sums', 'Point', 'PointPtr',
+                                            'state', 'handler']))
+
+
+class TestPartition(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, filename, contents):
+        path = os.path.join(self.tmp_dir, filename)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_clashes_compiled_separately(self):
+        a = self.write('a.cpp', 'static int helper() { return 1; }\n')
+        b = self.write('b.cpp', 'int b() { return 2; }\n')
+        c = self.write('c.cpp', 'static int helper() { return 3; }\n')
+        d = self.write('d.cpp', '#define b 4\n')
+        e = self.write('e.cpp', 'int helper2() { return 5; }\n')
+        assert_equal(partition([a, b, c, d, e]), ([a, b, e], [c, d]))
+
+    def test_namespace_clashes(self):
+        src = 'namespace util {\n  static int counter;\n  struct State { int x; };\n}\n'
+        a = self.write('a.cpp', src)
+        b = self.write('b.cpp', src)
+        c = self.write('c.cpp', 'namespace other { static int counter; }\n')
+        assert_equal(partition([a, b, c]), ([a, c], [b]))
+
+    def test_several_declarators(self):
+        a = self.write('a.c', 'static int cnt, total;\n')
+        b = self.write('b.c', 'static int cnt = 5;\n')
+        c = self.write('c.c', 'int other = 1, *more;\n')
+        assert_equal(partition([a, b, c]), ([a, c], [b]))
+
+    def test_anonymous_typedef(self):
+        a = self.write('a.c', 'typedef struct { int x; } Point;\n')
+        b = self.write('b.c', 'typedef struct { long x, y; } Point;\n')
+        c = self.write('c.c', 'typedef struct { int x; } Size, *SizePtr;\n')
+        assert_equal(partition([a, b, c]), ([a, c], [b]))
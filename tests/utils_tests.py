@@ -0,0 +1,56 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+from ino.filters import glob
+from ino.utils import DirSnapshot, list_subdirs, write_atomically
+
+
+class TestDirSnapshot(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.write('src/main.cpp')
+        self.write('src/util/util.c')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir, *parts)
+
+    def write(self, filename):
+        path = self.path(filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('')
+
+    def test_listings_reused(self):
+        with DirSnapshot() as snapshot:
+            assert_equal(sorted(glob(self.path('src'), '*.c', '*.cpp').paths()),
+                         [self.path('src', 'main.cpp'), self.path('src', 'util', 'util.c')])
+            self.write('src/new/new.cpp')
+            assert_equal(list_subdirs(self.path('src')), [self.path('src', 'util')])
+
+            snapshot.invalidate(self.path('src', 'new'))
+            assert_equal(sorted(list_subdirs(self.path('src'))),
+                         [self.path('src', 'new'), self.path('src', 'util')])
+
+        assert_equal(DirSnapshot.current, None)
+
+
+def test_write_atomically():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'data.pickle')
+        write_atomically(path, 'old')
+        write_atomically(path, 'new')
+        assert_equal(open(path).read(), 'new')
+        assert_equal(os.listdir(tmp_dir), ['data.pickle'])
+    finally:
+        shutil.rmtree(tmp_dir)